@@ -1,133 +1,30 @@
 
+from tamv_pipeline.scheduler import AdaptiveScheduler
+from tamv_pipeline.streaming import start_stream_server
+from tamv_pipeline.pipeline import AlgorithmThread
+from tamv_pipeline.capture import VideoCapture
+from tamv_pipeline.overlay import Overlay
 from PIL import ImageTk, Image
 from tkinter import ttk
-import importlib
-import threading
+import argparse
 import tkinter
+import time
 import cv2
 import os
 
 
-class AlgorithmLoader:
-    loaded_algorithms = {}
-
-    @staticmethod
-    def load_algorithm(name):
-        if name in AlgorithmLoader.loaded_algorithms:
-            return AlgorithmLoader.loaded_algorithms[name]
-        else:
-            algorithm = importlib.import_module(f'.{name}', 'tamv_algorithms')
-            AlgorithmLoader.loaded_algorithms[name] = algorithm
-            return algorithm
-
-
-class AlgorithmThread(threading.Thread):
-    def __init__(self, window):
-        self.algorithms = []
-        self.window = window
-
-        self.temp_algorithms = []
-
-        self.should_exit = False
-
-        self.frame = None
-        self.keypoints = None
-
-        threading.Thread.__init__(self)
-
-    def run(self):
-        while not self.should_exit:
-            if len(self.temp_algorithms) > 0:
-                self.algorithms = self.temp_algorithms.copy()
-                self.temp_algorithms.clear()
-
-            frame = self.window.stream.get_frame()
-            if frame is not None:
-                additional_info = None
-                for algorithm in self.algorithms:
-                    try:
-                        frame, additional_info = algorithm.process(frame, additional_info)
-                    except cv2.error:
-                        pass
-                self.keypoints = additional_info['keypoints']
-                self.frame = frame
-
-    def load_algorithms(self, algorithm_names):
-        print(algorithm_names)
-        self.temp_algorithms = []
-        for algorithm_name in algorithm_names:
-            algorithm = AlgorithmLoader.load_algorithm(algorithm_name)
-            self.temp_algorithms.append(algorithm)
-
-    def close(self):
-        self.should_exit = True
-
-
-class Overlay:
-    def __init__(self):
-        self.overlays = []
-
-    def draw(self, frame):
-        for overlay in self.overlays:
-            if overlay[0] == 'circle':
-                frame = cv2.circle(frame, *tuple(overlay[1:]))
-
-            elif overlay[0] == 'crosshair0':
-                frame = cv2.line(frame,
-                                 (overlay[1][0] - overlay[2], overlay[1][1]),
-                                 (overlay[1][0] + overlay[2], overlay[1][1]),
-                                 overlay[3], overlay[4])
-                frame = cv2.line(frame,
-                                 (overlay[1][0], overlay[1][1] - overlay[2]),
-                                 (overlay[1][0], overlay[1][1] + overlay[2]),
-                                 overlay[3], overlay[4])
-
-        return frame
-
-    def clear(self):
-        self.overlays = []
-
-    def add_circle(self, position, radius, color=(255, 0, 0), stroke=1):
-        self.overlays.append(['circle', position, radius, color, stroke])
-
-    def add_crosshair(self, position, radius, color=(255, 0, 0), stroke=1, style=0):
-        self.overlays.append([f'crosshair{style}', position, radius, color, stroke])
-
-
-class VideoCapture:
-    def __init__(self, video_source=0):
-        self.stream = cv2.VideoCapture(video_source)
-        if not self.stream.isOpened():
-            raise ValueError('Unable to open video source ', video_source)
-
-        self.width = self.stream.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.height = self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT)
-
-    def get_frame(self):
-        if self.stream.isOpened():
-            success, frame = self.stream.read()
-            if success:
-                return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            else:
-                return None
-        else:
-            return None
-
-    def __del__(self):
-        if self.stream.isOpened():
-            self.stream.release()
-
-
 class Window:
-    def __init__(self, window_title='', video_source=0, desired_fps=60):
+    def __init__(self, window_title='', video_source=0, desired_fps=60, capture_options=None, stream_port=None):
         self.window = tkinter.Tk()
         self.window.title(window_title)
         self.window.protocol('WM_DELETE_WINDOW', self.on_close)
 
         self.__desired_frametime = int((1 / desired_fps) * 1000)
+        self.idle_frametime = 100
 
-        self.stream = VideoCapture(video_source)
+        self.stream = VideoCapture(video_source, **(capture_options or {}))
         self.keypoints = None
+        self.radii = None
         self.frame = None
 
         self.popup = None
@@ -137,6 +34,12 @@ class Window:
         self.stream_canvas = tkinter.Canvas(self.window, width=640, height=480)
         self.stream_canvas.place(x=10, y=10, width=640, height=640)
 
+        # A single canvas item whose image is repainted in place
+        self.display_size = (640, 480)
+        self.display_image = None
+        self.display_item = self.stream_canvas.create_image(0, 0, anchor=tkinter.NW)
+        self.display_sequence = None
+
         # Algorithms Selection
         self.algorithm_selection = tkinter.Listbox(self.window, selectmode=tkinter.SINGLE, width=24, height=16)
 
@@ -159,6 +62,10 @@ class Window:
 
         self.algorithm_last_selection = None
 
+        self.freeze_value = tkinter.BooleanVar()
+        self.freeze_checkbox = tkinter.Checkbutton(self.window, text='Freeze frame', var=self.freeze_value, command=self.toggle_freeze)
+        self.freeze_checkbox.place(x=660, y=481, width=150, height=18)
+
         # Algorithm Settings
         self.settings_frame = tkinter.Frame(self.window, relief=tkinter.SUNKEN, borderwidth=2)
         self.settings_canvas = tkinter.Canvas(self.settings_frame)
@@ -184,45 +91,98 @@ class Window:
 
         self.current_settings = {}
 
+        # Pipeline Statistics, in their own column so they never cover the video
+        self.stats_label = tkinter.Label(self.window, justify=tkinter.LEFT, anchor=tkinter.NW, font=('TkFixedFont', 8), relief=tkinter.SUNKEN, borderwidth=2)
+        self.stats_label.place(x=820, y=10, width=280, height=640)
+        self.window.geometry('1110x660')
+        self.stats_interval = 0.5
+        self.stats_last_update = 0
+
         # Algorithm Thread
-        self.algorithm_thread = AlgorithmThread(self)
+        self.algorithm_thread = AlgorithmThread(self.stream, scheduler=AdaptiveScheduler())
         self.algorithm_thread.load_algorithms(
             self.algorithm_selection.get(0, self.algorithm_selection.size())
         )
         self.algorithm_thread.start()
 
+        # Optional MJPEG stream of the processed frames, for watching the rig from a browser
+        self.stream_server = None
+        if stream_port is not None:
+            self.stream_server = start_stream_server({'camera': self.algorithm_thread}, port=stream_port)
+
         self.overlay = Overlay()
+        self.overlay_size = None
 
         self.update()
         self.window.mainloop()
 
     def update(self):
-        self.frame = self.algorithm_thread.frame
-        self.keypoints = self.algorithm_thread.keypoints
-
-        if self.frame is not None:
-            self.frame = ImageTk.PhotoImage(image=Image.fromarray(self.frame))
-            self.stream_canvas.create_image(0, 0, image=self.frame, anchor=tkinter.NW)
+        result = self.algorithm_thread.result
+        if result is not None and (result.sequence, result.revision) != self.display_sequence:
+            self.display_sequence = (result.sequence, result.revision)
+            self.frame = result.frame
+            self.keypoints = result.keypoints
+            self.radii = result.radii
+            self.show_frame(self.frame, result.colorspace)
+
+        now = time.monotonic()
+        if now - self.stats_last_update >= self.stats_interval:
+            self.stats_last_update = now
+            self.stats_label.configure(text=self.algorithm_thread.stats.format_table())
 
         try:
             current_algorithm = self.algorithm_selection.get(self.algorithm_selection.curselection())
 
-            algorithm_instance = AlgorithmLoader.loaded_algorithms[current_algorithm]
-            try:
-                for setting in self.current_settings:
-                    algorithm_instance.settings[setting][0] = self.current_settings[setting][2].get()
-            except KeyError:
-                pass
-
-            if current_algorithm != self.algorithm_last_selection:
+            algorithm_instance = self.algorithm_thread.stages[current_algorithm]
+            if current_algorithm == self.algorithm_last_selection:
+                # The algorithm thread picks up the new snapshot on its next frame
+                algorithm_instance.update(**{
+                    setting: widgets[2].get() for setting, widgets in self.current_settings.items()
+                })
+            else:
                 self.algorithm_last_selection = current_algorithm
 
                 self.load_settings(algorithm_instance)
 
-        except tkinter.TclError:
+        except (tkinter.TclError, KeyError):
             pass
 
-        self.window.after(self.__desired_frametime, self.update)
+        frametime = self.__desired_frametime
+        if self.algorithm_thread.scheduler.idle:
+            # Results only arrive at the idle rate, polling slower keeps the Tk thread quiet too
+            frametime = max(frametime, self.idle_frametime)
+        self.window.after(frametime, self.update)
+
+    def show_frame(self, frame, colorspace='RGB'):
+        height, width = frame.shape[:2]
+        scale = min(self.display_size[0] / width, self.display_size[1] / height)
+        if scale != 1:
+            frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+        elif colorspace == 'BGR':
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        elif scale == 1:
+            # Never draw on the algorithm thread's result
+            frame = frame.copy()
+
+        if self.overlay_size != frame.shape[:2]:
+            self.overlay_size = frame.shape[:2]
+            self.reset_overlay(frame.shape[1], frame.shape[0])
+        frame = self.overlay.draw(frame, self.keypoints, scale=scale, radii=self.radii)
+
+        image = Image.fromarray(frame)
+        if self.display_image is None or (self.display_image.width(), self.display_image.height()) != image.size:
+            self.display_image = ImageTk.PhotoImage(image=image)
+            self.stream_canvas.itemconfigure(self.display_item, image=self.display_image)
+        else:
+            self.display_image.paste(image)
+
+    def reset_overlay(self, width, height):
+        centre = (width // 2, height // 2)
+        self.overlay.clear()
+        self.overlay.add_crosshair(centre, 20, (255, 0, 0))
+        self.overlay.add_circle(centre, 30, (255, 0, 0), opacity=0.6)
 
     def set_desired_framerate(self, fps):
         self.__desired_frametime = int((1 / fps) * 1000)
@@ -289,18 +249,25 @@ class Window:
             self.algorithm_selection.get(0, self.algorithm_selection.size())
         )
 
+    def toggle_freeze(self):
+        self.algorithm_thread.freeze(self.freeze_value.get())
+
     def on_close(self):
-        self.algorithm_thread.should_exit = True
+        if self.stream_server is not None:
+            self.stream_server.close()
+        self.algorithm_thread.close()
         self.window.destroy()
 
     def load_settings(self, algorithm):
         for setting in self.current_settings:
             self.current_settings[setting][0].destroy()
             self.current_settings[setting][1].destroy()
+        self.current_settings = {}
 
         i = 0
         for setting in algorithm.settings:
-            value, tkinter_type, minimum_value, maximum_value = algorithm.settings[setting]
+            _, tkinter_type, minimum_value, maximum_value = algorithm.settings[setting]
+            value = algorithm.snapshot[setting]
 
             if tkinter_type == 'slider':
                 tkinter_label = tkinter.Label(self.settings_scrollable_frame, text=setting)
@@ -329,4 +296,12 @@ class Window:
                 self.current_settings[setting] = (tkinter_label, tkinter_scale, checkbox_value)
 
 
-tk_window = Window()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TAMV tool alignment GUI')
+    parser.add_argument('--stream-port', type=int, metavar='PORT', help='also serve the processed frames as MJPEG over HTTP on this port')
+    args = parser.parse_args(argv)
+    Window(stream_port=args.stream_port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+from benchmarks.synthetic import RESOLUTIONS, generate_frames
+from benchmarks.timing import latency_summary
+from tamv_pipeline.pipeline import AlgorithmLoader
+from tamv_pipeline.compiler import FrameInfo, compile_chain, convert
+import numpy as np
+import itertools
+import argparse
+import platform
+import json
+import time
+import cv2
+import sys
+
+
+DEFAULT_CHAINS = [
+    ['gaussian_blur', 'grayscale', 'hough_circle_finder'],
+    ['grayscale', 'hough_circle_finder'],
+    ['grayscale', 'pyramid_circle_finder'],
+    ['grayscale', 'template_locator'],
+]
+
+# Used when no --set or --sweep is given, the stage defaults would measure a 1x1 blur
+DEFAULT_SETTINGS = {
+    'gaussian_blur': {'blur_x': 35, 'blur_y': 35},
+}
+
+# A template is not scale invariant, chains with a template stage get a fixed nozzle size unless --radius is given
+TEMPLATE_RADIUS = 0.09
+
+
+def uses_template(algorithm_names):
+    return any(hasattr(AlgorithmLoader.load_algorithm(name), 'capture_template') for name in algorithm_names)
+
+
+def centre_error(keypoints, truth):
+    if not keypoints:
+        return None
+    points = np.asarray(keypoints, dtype=np.float64)[:, :2]
+    return float(np.min(np.hypot(points[:, 0] - truth[0], points[:, 1] - truth[1])))
+
+
+def parse_setting(value):
+    # stage.setting=value[,value...], values take the type of the setting's default
+    target, _, values = value.partition('=')
+    stage, _, setting = target.partition('.')
+    spec = AlgorithmLoader.load_algorithm(stage).settings
+    if setting not in spec or not values:
+        raise argparse.ArgumentTypeError(f'expected stage.setting=value with a setting of {stage}: {", ".join(spec)}')
+
+    default = spec[setting][0]
+    if isinstance(default, bool):
+        parse = lambda text: text.lower() in ('1', 'true', 'yes', 'on')
+    else:
+        parse = type(default)
+    try:
+        return stage, setting, [parse(text) for text in values.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid value for {stage}.{setting}: {values}')
+
+
+def settings_combinations(fixed, sweeps):
+    # One settings dict per point of the sweep grid, fixed values applied to all of them
+    combinations = []
+    for values in itertools.product(*(sweep_values for _, _, sweep_values in sweeps)):
+        settings = {stage: dict(stage_settings) for stage, stage_settings in fixed.items()}
+        for (stage, setting, _), value in zip(sweeps, values):
+            settings.setdefault(stage, {})[setting] = value
+        combinations.append(settings)
+    return combinations
+
+
+def chain_label(algorithm_names, settings):
+    parts = []
+    for name in algorithm_names:
+        stage_settings = settings.get(name)
+        if stage_settings:
+            name += '(' + ','.join(f'{setting}={value}' for setting, value in stage_settings.items()) + ')'
+        parts.append(name)
+    return '+'.join(parts)
+
+
+def benchmark_chain(algorithm_names, frames, repeat=1, settings=None):
+    settings = settings or {}
+    algorithms = [AlgorithmLoader.create(name, **settings.get(name, {})) for name in algorithm_names]
+    # Synthetic frames are gray, they go in as BGR the way a camera delivers them.
+    # No-op stages are kept, a benchmark asked for a stage should measure it
+    steps, _ = compile_chain(algorithm_names, algorithms, 'BGR', elide_noops=False)
+
+    # Template locators get their reference from the first frame, the way a user would line up the nozzle once
+    for step in steps:
+        if hasattr(step.algorithm, 'capture_template'):
+            first = frames[0]
+            step.algorithm.capture_template(convert(first.image, 'BGR', 'GRAY'), first.centre, int(first.radius * 2.5))
+
+    stage_times = [[] for _ in steps]
+    chain_times = []
+    errors = []
+    detections = 0
+
+    # Warm up caches and lazy OpenCV initialisation
+    frame = frames[0].image
+    info = FrameInfo('BGR')
+    for step in steps:
+        try:
+            frame, info = step.run(frame, info)
+        except cv2.error:
+            pass
+
+    for _ in range(repeat):
+        for synthetic in frames:
+            frame = synthetic.image
+            info = FrameInfo('BGR')
+            chain_start = time.perf_counter()
+            for i, step in enumerate(steps):
+                stage_start = time.perf_counter()
+                try:
+                    frame, info = step.run(frame, info)
+                except cv2.error:
+                    pass
+                stage_times[i].append(time.perf_counter() - stage_start)
+            chain_times.append(time.perf_counter() - chain_start)
+
+            error = centre_error(info.keypoints, synthetic.centre)
+            if error is not None and error < synthetic.radius / 2:
+                detections += 1
+                errors.append(error)
+
+    errors = np.asarray(errors, dtype=np.float64)
+    total = len(chain_times)
+    return {
+        'chain': algorithm_names,
+        'settings': {name: dict(settings[name]) for name in algorithm_names if settings.get(name)},
+        'frames': total,
+        'stages': {step.name: latency_summary(times) for step, times in zip(steps, stage_times)},
+        'total': latency_summary(chain_times),
+        'fps': total / sum(chain_times) if chain_times else 0,
+        'detection_rate': detections / total if total else 0,
+        'centre_error_px': {
+            'mean': float(errors.mean()),
+            'median': float(np.median(errors)),
+            'p90': float(np.percentile(errors, 90)),
+            'max': float(errors.max()),
+        } if errors.size else None,
+    }
+
+
+def run(chains, resolutions, count, repeat=1, seed=0, settings=None, radius=None, **frame_options):
+    results = {}
+    for width, height in resolutions:
+        frame_sets = {}
+        for chain in chains:
+            chain_radius = TEMPLATE_RADIUS if radius is None and uses_template(chain) else radius
+            if chain_radius not in frame_sets:
+                frame_sets[chain_radius] = generate_frames(width, height, count, seed, radius=chain_radius, **frame_options)
+            frames = frame_sets[chain_radius]
+            for chain_settings in settings or [{}]:
+                key = f'{chain_label(chain, chain_settings)}@{width}x{height}'
+                if key in results:
+                    # A swept stage that is not in this chain gives the same run again
+                    continue
+                results[key] = benchmark_chain(chain, frames, repeat, chain_settings)
+                results[key]['resolution'] = [width, height]
+    return results
+
+
+def print_results(results, baseline=None):
+    baseline_results = baseline['results'] if baseline else {}
+    for key, result in results.items():
+        print(key)
+        for name, summary in result['stages'].items():
+            print(f'    {name:<24} p50 {summary["p50_ms"]:8.2f} ms  p90 {summary["p90_ms"]:8.2f} ms  p99 {summary["p99_ms"]:8.2f} ms')
+
+        total = result['total']
+        line = f'    {"total":<24} p50 {total["p50_ms"]:8.2f} ms  p90 {total["p90_ms"]:8.2f} ms  {result["fps"]:7.1f} fps'
+        if key in baseline_results:
+            previous = baseline_results[key]['total']['p50_ms']
+            line += f'  ({(total["p50_ms"] - previous) / previous * 100:+.1f}% p50 vs baseline)'
+        print(line)
+
+        error = result['centre_error_px']
+        detection = f'    detected {result["detection_rate"] * 100:5.1f}%'
+        if error is not None:
+            detection += f'  centre error median {error["median"]:.3f} px  p90 {error["p90"]:.3f} px  max {error["max"]:.3f} px'
+        print(detection)
+
+
+def parse_resolution(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark tamv_algorithms stages on synthetic nozzle frames')
+    parser.add_argument('-c', '--chain', action='append', nargs='+', help='algorithm chain to benchmark, may be repeated')
+    parser.add_argument('-r', '--resolution', action='append', type=parse_resolution, help='WIDTHxHEIGHT, may be repeated')
+    parser.add_argument('-n', '--frames', type=int, default=50, help='synthetic frames per resolution')
+    parser.add_argument('--repeat', type=int, default=1, help='passes over the frame set')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--noise', type=float, default=8.0, help='gaussian noise sigma')
+    parser.add_argument('--blur', type=float, default=1.5, help='optical blur sigma')
+    parser.add_argument('--gradient', type=float, default=60.0, help='lighting gradient amplitude')
+    parser.add_argument('--radius', type=float,
+                        help=f'fixed nozzle radius as a fraction of the shorter side, by default random, or {TEMPLATE_RADIUS} for template chains')
+    parser.add_argument('--motion', type=float, default=8.0,
+                        help='pixels the nozzle may move between frames, 0 for an independent position every frame')
+    parser.add_argument('--set', action='append', type=parse_setting, metavar='STAGE.SETTING=VALUE',
+                        help='stage setting for every chain, may be repeated, defaults to a 35x35 gaussian blur')
+    parser.add_argument('--sweep', action='append', type=parse_setting, metavar='STAGE.SETTING=V1,V2,...',
+                        help='benchmark every chain once per value, repeated sweeps are combined')
+    parser.add_argument('-o', '--output', help='write results as a JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    args = parser.parse_args(argv)
+
+    if args.set is None and args.sweep is None:
+        fixed = DEFAULT_SETTINGS
+    else:
+        fixed = {}
+        for stage, setting, values in args.set or []:
+            fixed.setdefault(stage, {})[setting] = values[-1]
+    # Stages only get settings they are in the chain for, chain_label leaves the rest out
+    settings = settings_combinations(fixed, args.sweep or [])
+
+    results = run(
+        args.chain or DEFAULT_CHAINS,
+        args.resolution or RESOLUTIONS,
+        args.frames,
+        args.repeat,
+        args.seed,
+        settings,
+        radius=args.radius, noise=args.noise, blur=args.blur, gradient=args.gradient, motion=args.motion
+    )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(),
+                    'opencv': cv2.__version__,
+                    'numpy': np.__version__,
+                    'machine': platform.machine(),
+                    'frames': args.frames,
+                    'repeat': args.repeat,
+                    'seed': args.seed,
+                    'noise': args.noise,
+                    'blur': args.blur,
+                    'gradient': args.gradient,
+                    'radius': args.radius,
+                    'motion': args.motion,
+                    'sweep': [[f'{stage}.{setting}', values] for stage, setting, values in args.sweep or []],
+                },
+                'results': results,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+from duetwebapi.simulator import SimulatedPrinter, start_simulator
+from duetwebapi.duetwebapi import DuetWebAPI
+from benchmarks.timing import latency_summary
+import requests
+import argparse
+import platform
+import tempfile
+import asyncio
+import json
+import time
+import sys
+
+
+JOGS = ['G1 X0 Y0'] * 10
+ERRORS = (requests.exceptions.RequestException, ValueError, KeyError)
+
+
+def connect(url, attempts=20, **kwargs):
+    # The firmware probe sees injected errors too, retried here and counted against the scenario
+    errors = 0
+    while True:
+        try:
+            return DuetWebAPI(url, **kwargs), errors
+        except ERRORS:
+            errors += 1
+            if errors >= attempts:
+                raise
+
+
+def measure(name, operation, iterations, count_requests, errors=0):
+    samples = []
+    requests_before = count_requests()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        operation_start = time.perf_counter()
+        try:
+            operation()
+        except ERRORS:
+            errors += 1
+        samples.append(time.perf_counter() - operation_start)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'name': name,
+        'iterations': iterations,
+        'errors': errors,
+        'ops_per_second': iterations / elapsed if elapsed > 0 else 0,
+        'requests_per_op': (count_requests() - requests_before) / iterations,
+        'latency': latency_summary(samples),
+    }
+
+
+def make_printer(firmware, file_size):
+    # A job-sized file, a few bytes of config.g cost the same to fetch as the info request that validates the cache
+    line = 'G1 X10.000 Y10.000 E0.01000\n'
+    return SimulatedPrinter(firmware, files={'sys/config.g': line * max(file_size // len(line), 1)})
+
+
+def sync_scenarios(server, iterations):
+    url = server.url()
+    results = []
+    count_requests = lambda: server.requests
+
+    results.append(measure('connect', lambda: DuetWebAPI(url).close(), max(iterations // 10, 1), count_requests))
+
+    uncached, errors = connect(url, status_ttl=0)
+    def tick_uncached():
+        uncached.get_coords()
+        uncached.get_g10_tool_offsets(0)
+        uncached.get_status()
+    results.append(measure('status_tick_uncached', tick_uncached, iterations, count_requests, errors))
+
+    cached, errors = connect(url)
+    def tick_snapshot():
+        cached.snapshot.invalidate()
+        cached.get_coords()
+        cached.get_g10_tool_offsets(0)
+        cached.get_status()
+    results.append(measure('status_tick_snapshot', tick_snapshot, iterations, count_requests, errors))
+
+    def g_code_single():
+        for command in JOGS:
+            cached.g_code(command)
+    results.append(measure('g_code_x10_single', g_code_single, iterations, count_requests))
+    results.append(measure('g_code_x10_batched', lambda: cached.send_g_codes(JOGS), iterations, count_requests))
+
+    results.append(measure('get_file', lambda: cached.get_file('sys/config.g'), iterations, count_requests))
+    with tempfile.TemporaryDirectory() as cache_directory:
+        file_cached, errors = connect(url, file_cache=cache_directory)
+        results.append(measure(
+            'get_file_cached', lambda: file_cached.get_file('sys/config.g'), iterations, count_requests, errors
+        ))
+        file_cached.close()
+
+    uncached.close()
+    cached.close()
+    return results
+
+
+def fleet_scenarios(servers, iterations):
+    urls = [server.url() for server in servers]
+    results = []
+    count_requests = lambda: sum(server.requests for server in servers)
+
+    connected = [connect(url) for url in urls]
+    clients = [client for client, _ in connected]
+    def sequential_sweep():
+        for client in clients:
+            client.snapshot.invalidate()
+            client.get_status()
+    results.append(measure(
+        f'fleet_{len(urls)}_sequential', sequential_sweep, iterations, count_requests,
+        sum(errors for _, errors in connected)
+    ))
+    for client in clients:
+        client.close()
+
+    try:
+        from duetwebapi.async_duetwebapi import DuetFleet
+    except ImportError:
+        print('aiohttp is not installed, skipping the async fleet benchmark', file=sys.stderr)
+        return results
+
+    async def run_fleet(attempts=20):
+        async with DuetFleet(urls) as fleet:
+            # Printers that failed to connect are retried, like the synchronous clients
+            errors = len(fleet.errors)
+            for _ in range(attempts - 1):
+                if not fleet.errors:
+                    break
+                await fleet.connect()
+                errors += len(fleet.errors)
+
+            loop = asyncio.get_running_loop()
+            samples = []
+            requests_before = count_requests()
+            for _ in range(iterations):
+                start = loop.time()
+                for printer in fleet.printers.values():
+                    printer.invalidate_status()
+                # Failed printers come back as their exception instead of raising
+                replies = await fleet.poll()
+                samples.append(loop.time() - start)
+                errors += sum(isinstance(reply, Exception) for reply in replies.values())
+            return samples, errors, count_requests() - requests_before
+
+    samples, errors, request_count = asyncio.run(run_fleet())
+    results.append({
+        'name': f'fleet_{len(urls)}_async',
+        'iterations': iterations,
+        'errors': errors,
+        'ops_per_second': iterations / sum(samples) if samples else 0,
+        'requests_per_op': request_count / iterations,
+        'latency': latency_summary(samples),
+    })
+    return results
+
+
+def print_results(results, baseline=None):
+    baseline_results = {result['name']: result for result in baseline['results']} if baseline else {}
+    for result in results:
+        latency = result['latency']
+        line = (
+            f'{result["name"]:<28} p50 {latency["p50_ms"]:8.2f} ms  p99 {latency["p99_ms"]:8.2f} ms'
+            f'  {result["ops_per_second"]:8.1f} ops/s'
+        )
+        if result['requests_per_op'] is not None:
+            line += f'  {result["requests_per_op"]:5.1f} req/op'
+        if result['errors']:
+            line += f'  {result["errors"]} errors'
+        if result['name'] in baseline_results:
+            previous = baseline_results[result['name']]['latency']['p50_ms']
+            line += f'  ({(latency["p50_ms"] - previous) / previous * 100:+.1f}% p50 vs baseline)'
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark DuetWebAPI against the local Duet simulator')
+    parser.add_argument('--firmware', type=int, choices=[2, 3], default=3)
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.002, help='mean injected latency per request in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--file-kb', type=int, default=64, help='size of the file fetched by the get_file scenarios')
+    parser.add_argument('--bandwidth-kb', type=float, default=1024, help='simulated board bandwidth in KiB/s, 0 for unlimited')
+    parser.add_argument('--fleet', type=int, default=16, help='simulated printers for the fleet sweep, 0 to skip')
+    parser.add_argument('-o', '--output', help='write results as a JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    args = parser.parse_args(argv)
+
+    bandwidth = args.bandwidth_kb * 1024 if args.bandwidth_kb else None
+    server = start_simulator(
+        make_printer(args.firmware, args.file_kb * 1024), latency=args.latency, error_rate=args.error_rate,
+        bandwidth=bandwidth
+    )
+    results = sync_scenarios(server, args.iterations)
+    server.shutdown()
+
+    if args.fleet:
+        servers = [
+            start_simulator(SimulatedPrinter(args.firmware), latency=args.latency, error_rate=args.error_rate, bandwidth=bandwidth)
+            for _ in range(args.fleet)
+        ]
+        results += fleet_scenarios(servers, max(args.iterations // 10, 1))
+        for fleet_server in servers:
+            fleet_server.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'firmware': args.firmware,
+                    'iterations': args.iterations,
+                    'latency': args.latency,
+                    'error_rate': args.error_rate,
+                    'file_kb': args.file_kb,
+                    'bandwidth_kb': args.bandwidth_kb,
+                    'fleet': args.fleet,
+                },
+                'results': results,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
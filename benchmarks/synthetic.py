@@ -0,0 +1,65 @@
+import numpy as np
+import cv2
+
+
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+
+# cv2 drawing functions take fixed point coordinates with this many fractional bits
+SHIFT = 4
+
+
+class SyntheticFrame:
+    def __init__(self, image, centre, radius):
+        self.image = image
+        self.centre = centre
+        self.radius = radius
+
+
+def generate_frame(width, height, rng, noise=8.0, blur=1.5, gradient=60.0, radius=None, centre=None):
+    # Radius as a fraction of the shorter side, random unless fixed like a real nozzle at a set height
+    radius = (radius if radius is not None else rng.uniform(0.06, 0.12)) * min(width, height)
+    if centre is None:
+        centre = (
+            rng.uniform(radius * 2, width - radius * 2),
+            rng.uniform(radius * 2, height - radius * 2)
+        )
+    else:
+        centre = (
+            float(np.clip(centre[0], radius * 2, width - radius * 2)),
+            float(np.clip(centre[1], radius * 2, height - radius * 2))
+        )
+
+    # Lighting gradient in a random direction
+    angle = rng.uniform(0, 2 * np.pi)
+    xs = np.linspace(-0.5, 0.5, width, dtype=np.float32)
+    ys = np.linspace(-0.5, 0.5, height, dtype=np.float32)
+    image = 110 + gradient * (np.cos(angle) * xs[None, :] + np.sin(angle) * ys[:, None])
+    image = np.repeat(image[:, :, None], 3, axis=2)
+
+    scale = 1 << SHIFT
+    fixed_centre = (int(round(centre[0] * scale)), int(round(centre[1] * scale)))
+    cv2.circle(image, fixed_centre, int(round(radius * scale)), (35, 35, 35), -1, cv2.LINE_AA, SHIFT)
+    cv2.circle(image, fixed_centre, int(round(radius * 0.9 * scale)), (200, 195, 190), -1, cv2.LINE_AA, SHIFT)
+    cv2.circle(image, fixed_centre, int(round(radius * 0.35 * scale)), (20, 20, 20), -1, cv2.LINE_AA, SHIFT)
+
+    if blur > 0:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+    if noise > 0:
+        image += rng.normal(0, noise, image.shape).astype(np.float32)
+
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    return SyntheticFrame(image, centre, radius)
+
+
+def generate_frames(width, height, count, seed=0, motion=None, **kwargs):
+    # With motion the nozzle wanders up to that many pixels per frame, like a camera during a jog and measure loop,
+    # otherwise every frame puts it somewhere new
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        centre = None
+        if motion and frames:
+            step = rng.uniform(-motion, motion, 2)
+            centre = (frames[-1].centre[0] + step[0], frames[-1].centre[1] + step[1])
+        frames.append(generate_frame(width, height, rng, centre=centre, **kwargs))
+    return frames
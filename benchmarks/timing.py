@@ -0,0 +1,14 @@
+import numpy as np
+
+
+def latency_summary(samples):
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    if samples.size == 0:
+        return None
+    return {
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p90_ms': float(np.percentile(samples, 90)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'max_ms': float(samples.max()),
+    }
@@ -0,0 +1,204 @@
+from duetwebapi.duetwebapi import status_path, parse_coords, parse_layer, parse_g10_tool_offsets, \
+    parse_extruder_count, parse_tool_count, parse_status, parse_temperatures
+import asyncio
+import aiohttp
+import json
+
+
+class AsyncDuetWebAPI:
+    def __init__(self, printer_url, session=None, timeout=5, status_ttl=0.1):
+        self.__printer_url = printer_url
+        self.__printer_type = None
+        self.__session = session
+        self.__owns_session = session is None
+
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.status_ttl = status_ttl
+        self.__status_cache = {}
+
+    @classmethod
+    async def connect(cls, printer_url, **kwargs):
+        api = cls(printer_url, **kwargs)
+        try:
+            await api.detect()
+        except ValueError:
+            await api.close()
+            raise
+        return api
+
+    async def detect(self):
+        # Probe both firmware flavours at once rather than waiting for the first to time out
+        rrf2, rrf3 = await asyncio.gather(self.__probe('rr_status?type=1'), self.__probe('machine/status'))
+        if rrf2:
+            self.__printer_type = 2
+        elif rrf3:
+            self.__printer_type = 3
+        else:
+            raise ValueError('RRF2 or RRF3 printer cannot be reached')
+
+    def __get_session(self):
+        if self.__session is None:
+            self.__session = aiohttp.ClientSession()
+        return self.__session
+
+    async def __probe(self, path):
+        try:
+            async with self.__get_session().get(f'{self.__printer_url}/{path}', timeout=self.timeout) as response:
+                return response.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def __get_text(self, path, **kwargs):
+        async with self.__get_session().get(f'{self.__printer_url}/{path}', timeout=self.timeout, **kwargs) as response:
+            return await response.text()
+
+    async def __fetch_status(self, path):
+        return json.loads(await self.__get_text(path))
+
+    async def __status(self, status_type=2):
+        path = status_path(self.__printer_type, status_type)
+        now = asyncio.get_running_loop().time()
+
+        # Concurrent callers within the TTL share a single in-flight request
+        cached = self.__status_cache.get(path)
+        if cached is not None and (not cached[1].done() or now - cached[0] < self.status_ttl):
+            return await asyncio.shield(cached[1])
+
+        task = asyncio.ensure_future(self.__fetch_status(path))
+        self.__status_cache[path] = (now, task)
+        try:
+            return await asyncio.shield(task)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            self.__status_cache.pop(path, None)
+            raise
+
+    def invalidate_status(self):
+        self.__status_cache.clear()
+
+    def printer_type(self):
+        return self.__printer_type
+
+    def printer_url(self):
+        return self.__printer_url
+
+    async def get_coords(self):
+        return parse_coords(self.__printer_type, await self.__status())
+
+    async def get_layer(self):
+        return parse_layer(self.__printer_type, await self.__status(3))
+
+    async def get_g10_tool_offsets(self, tool):
+        return parse_g10_tool_offsets(self.__printer_type, await self.__status(), tool)
+
+    async def get_extruder_count(self):
+        return parse_extruder_count(self.__printer_type, await self.__status())
+
+    async def get_tool_count(self):
+        return parse_tool_count(self.__printer_type, await self.__status())
+
+    async def get_status(self):
+        return parse_status(self.__printer_type, await self.__status())
+
+    async def get_temperatures(self):
+        if self.__printer_type == 2:
+            return parse_temperatures(self.__printer_type, None)
+        return parse_temperatures(self.__printer_type, await self.__status())
+
+    async def g_code(self, command):
+        session = self.__get_session()
+
+        if self.__printer_type == 2:
+            request = session.get(f'{self.__printer_url}/rr_gcode', params={'gcode': command}, timeout=self.timeout)
+        else:
+            request = session.post(f'{self.__printer_url}/machine/code/', data=command, timeout=self.timeout)
+
+        async with request as response:
+            self.invalidate_status()
+            if response.ok:
+                return 0
+            else:
+                print(f'gCode command returns code: {response.status}')
+                print(response.reason)
+                return response.status
+
+    async def get_file(self, filename):
+        if self.__printer_type == 2:
+            text = await self.__get_text('rr_download', params={'name': filename})
+        else:
+            text = await self.__get_text(f'machine/file/{filename}')
+        return text.splitlines()
+
+    async def close(self):
+        if self.__owns_session and self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    async def __aenter__(self):
+        if self.__printer_type is None:
+            await self.detect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class DuetFleet:
+    def __init__(self, printer_urls, concurrency=16, timeout=5, status_ttl=0.1):
+        self.printer_urls = list(printer_urls)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.status_ttl = status_ttl
+
+        self.printers = {}
+        self.errors = {}
+        self.__session = None
+        self.__semaphore = None
+
+    async def __bounded(self, coroutine):
+        async with self.__semaphore:
+            return await coroutine
+
+    async def connect(self):
+        if self.__session is None:
+            self.__session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency))
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def connect_one(printer_url):
+            try:
+                self.printers[printer_url] = await self.__bounded(AsyncDuetWebAPI.connect(
+                    printer_url, session=self.__session, timeout=self.timeout, status_ttl=self.status_ttl
+                ))
+                self.errors.pop(printer_url, None)
+            except ValueError as error:
+                self.errors[printer_url] = error
+
+        await asyncio.gather(*(connect_one(url) for url in self.printer_urls if url not in self.printers))
+        return self
+
+    async def poll(self, query=AsyncDuetWebAPI.get_status):
+        async def poll_one(printer_url, printer):
+            try:
+                return printer_url, await self.__bounded(query(printer))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as error:
+                return printer_url, error
+
+        results = dict(self.errors)
+        results.update(await asyncio.gather(*(poll_one(url, printer) for url, printer in self.printers.items())))
+        return results
+
+    async def close(self):
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+        self.printers = {}
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+async def poll_printers(printer_urls, query=AsyncDuetWebAPI.get_status, concurrency=16, timeout=5):
+    async with DuetFleet(printer_urls, concurrency, timeout) as fleet:
+        return await fleet.poll(query)
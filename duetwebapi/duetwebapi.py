@@ -1,23 +1,222 @@
-
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote
+import threading
 import requests
+import hashlib
 import json
+import time
+import os
+
+
+NEWLINE_ENCODED = quote('\n')
+
+# RRF2 passes G-code in the rr_gcode query string, keep blocks well inside its URL buffer
+RRF2_MAX_GCODE_LENGTH = 200
+
+
+def status_path(printer_type, status_type=2):
+    if printer_type == 2:
+        return f'rr_status?type={status_type}'
+    return 'machine/status'
+
+
+def parse_coords(printer_type, reply):
+    ret = {}
+    if printer_type == 2:
+        reply_coords = reply['coords']['xyz']
+        reply_axis_names = reply['axisNames']
+        for i in range(len(reply_coords)):
+            ret[reply_axis_names[i]] = reply_coords[i]
+
+    elif printer_type == 3:
+        reply_axes = reply['axes']
+        for i in range(len(reply_axes)):
+            ret[reply_axes[i]['letter']] = reply_axes[i]['userPosition']
+    return ret
+
+
+def parse_layer(printer_type, reply):
+    if printer_type == 2:
+        return reply['currentLayer']
+
+    elif printer_type == 3:
+        ret = reply['job']['layer']
+        if ret is None:
+            ret = 0
+        return ret
+
+
+def parse_g10_tool_offsets(printer_type, reply, tool):
+    ret = {}
+    if printer_type == 2:
+        reply_axis_names = reply['axisNames']
+        tool_offsets = reply['tools'][tool]['offsets']
+        for i in range(len(tool_offsets)):
+            ret[reply_axis_names[i]] = tool_offsets[i]
+
+    elif printer_type == 3:
+        reply_axes = reply['move']['axes']
+        tool_offsets = reply['tools'][tool]['offsets']
+        for i in range(len(tool_offsets)):
+            ret[reply_axes[i]['letter']] = tool_offsets[i]
+    return ret
+
+
+def parse_extruder_count(printer_type, reply):
+    if printer_type == 2:
+        return len(reply['coords']['extr'])
+
+    elif printer_type == 3:
+        return len(reply['move']['extruders'])
+
+
+def parse_tool_count(printer_type, reply):
+    return len(reply['tools'])
+
+
+def parse_status(printer_type, reply):
+    if printer_type == 2:
+        status = reply['status']
+        if 'I' in status:
+            return 'idle'
+        elif 'P' in status:
+            return 'processing'
+        elif 'S' in status:
+            return 'paused'
+        elif 'B' in status:
+            return 'cancelling'
+        else:
+            return status
+
+    elif printer_type == 3:
+        return reply['state']['status']
+
+
+def parse_current_tool(printer_type, reply):
+    if printer_type == 2:
+        return reply['currentTool']
+
+    elif printer_type == 3:
+        return reply['state']['currentTool']
+
+
+def parse_temperatures(printer_type, reply):
+    if printer_type == 2:
+        return 'Error: get_temperatures no implemented for RRF2 printers'
+
+    elif printer_type == 3:
+        return reply['sensors']['analog']
+
+
+def batch_g_codes(commands, max_length=None):
+    # Join commands with newlines into as few blocks as fit in max_length once URL encoded
+    blocks = []
+    block = []
+    block_length = 0
+    for command in commands:
+        command_length = len(quote(command, safe=''))
+        if block and max_length is not None and block_length + len(NEWLINE_ENCODED) + command_length > max_length:
+            blocks.append('\n'.join(block))
+            block = []
+            block_length = 0
+
+        block_length += command_length + (len(NEWLINE_ENCODED) if block else 0)
+        block.append(command)
+
+    if block:
+        blocks.append('\n'.join(block))
+    return blocks
+
+
+def iter_lines_from_chunks(chunks):
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b'\r').decode('utf-8', 'replace')
+
+    if pending:
+        yield pending.rstrip(b'\r').decode('utf-8', 'replace')
+
+
+def iter_file_chunks(path, chunk_size):
+    with open(path, 'rb') as f:
+        yield from iter(lambda: f.read(chunk_size), b'')
+
+
+class FileCache:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, printer_url, filename, size, modified):
+        key = hashlib.sha1(f'{printer_url}\n{filename}\n{size}\n{modified}'.encode()).hexdigest()
+        return os.path.join(self.directory, key)
+
+
+class StatusSnapshot:
+    def __init__(self, fetch, ttl=0.1):
+        self.fetch = fetch
+        self.ttl = ttl
+
+        self.__cache = {}
+        self.__lock = threading.Lock()
+
+    def get(self, path):
+        # Holding the lock across the fetch lets concurrent callers share one request
+        with self.__lock:
+            cached = self.__cache.get(path)
+            if cached is not None and time.monotonic() - cached[0] < self.ttl:
+                return cached[1]
+
+            reply = self.fetch(path)
+            self.__cache[path] = (time.monotonic(), reply)
+            return reply
+
+    def invalidate(self):
+        with self.__lock:
+            self.__cache.clear()
 
 
 class DuetWebAPI:
-    def __init__(self, printer_url):
+    def __init__(self, printer_url, timeout=5, status_ttl=0.1, pool_size=4, file_cache=None):
         self.__printer_url = printer_url
+        self.timeout = timeout
+        self.file_cache = FileCache(file_cache) if isinstance(file_cache, str) else file_cache
+
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+
+        self.snapshot = StatusSnapshot(self.__fetch_status, status_ttl)
 
         try:
-            requests.get(f'{self.__printer_url}/rr_status?type=1')
+            self.__get('rr_status?type=1').raise_for_status()
             self.__printer_type = 2
         except requests.exceptions.RequestException:
 
             try:
-                requests.get(f'{self.__printer_url}/machine/status')
+                self.__get('machine/status').raise_for_status()
                 self.__printer_type = 3
             except requests.exceptions.RequestException:
                 raise ValueError('RRF2 or RRF3 printer cannot be reached')
 
+    def __get(self, path, **kwargs):
+        return self.__session.get(f'{self.__printer_url}/{path}', timeout=self.timeout, **kwargs)
+
+    def __post(self, path, **kwargs):
+        return self.__session.post(f'{self.__printer_url}/{path}', timeout=self.timeout, **kwargs)
+
+    def __fetch_status(self, path):
+        request = self.__get(path)
+        return json.loads(request.text)
+
+    def __status(self, status_type=2):
+        return self.snapshot.get(status_path(self.__printer_type, status_type))
+
     def printer_type(self):
         return self.__printer_type
 
@@ -25,114 +224,37 @@ class DuetWebAPI:
         return self.__printer_url
 
     def get_coords(self):
-        if self.__printer_type == 2:
-            request = requests.get(f'{self.__printer_url}/rr_status?type=2')
-            reply = json.loads(request.text)
-            reply_coords = reply['coords']['xyz']
-            reply_axis_names = reply['axisNames']
-            ret = {}
-            for i in range(len(reply_coords)):
-                ret[reply_axis_names[i]] = reply_coords[i]
-            return ret
-
-        elif self.__printer_type == 3:
-            request = requests.get(f'{self.__printer_url}/machine/status')
-            reply = json.loads(request.text)
-            reply_axes = reply['axes']
-            ret = {}
-            for i in range(len(reply_axes)):
-                ret[reply_axes[i]['letter']] = reply_axes[i]['userPosition']
-            return ret
+        return parse_coords(self.__printer_type, self.__status())
 
     def get_layer(self):
-        if self.__printer_type == 2:
-            request = requests.get(f'{self.__printer_url}/rr_status?type=3')
-            reply = json.loads(request.text)
-            ret = reply['currentLayer']
-            return ret
-
-        elif self.__printer_type == 3:
-            request = requests.get(f'{self.__printer_url}/machine/status')
-            reply = json.loads(request.text)
-            ret = reply['job']['layer']
-            if ret is None:
-                ret = 0
-            return ret
+        return parse_layer(self.__printer_type, self.__status(3))
 
     def get_g10_tool_offsets(self, tool):
-        if self.__printer_type == 2:
-            request = requests.get(f'{self.__printer_url}/rr_status?type=2')
-            reply = json.loads(request.text)
-            reply_axis_names = reply['axisNames']
-            reply_tools = reply['tools']
-            tool_offsets = reply_tools[tool]['offsets']
-            ret = {}
-            for i in range(len(tool_offsets)):
-                ret[reply_axis_names[i]] = tool_offsets[i]
-            return ret
-
-        elif self.__printer_type == 3:
-            request = requests.get(f'{self.__printer_url}/machine/status')
-            reply = json.loads(request.text)
-            reply_axes = reply['move']['axes']
-            reply_tools = reply['tools']
-            tool_offsets = reply_tools[tool]['offsets']
-            ret = {}
-            for i in range(len(tool_offsets)):
-                ret[reply_axes[i]['letter']] = tool_offsets[i]
-            return ret
+        return parse_g10_tool_offsets(self.__printer_type, self.__status(), tool)
 
     def get_extruder_count(self):
-        if self.__printer_type == 2:
-            request = requests.get(f'{self.__printer_url}/rr_status?type=2')
-            reply = json.loads(request.text)
-            return len(reply['coords']['extr'])
-
-        elif self.__printer_type == 3:
-            request = requests.get(f'{self.__printer_url}/machine/status')
-            reply = json.loads(request.text)
-            return len(reply['move']['extruders'])
+        return parse_extruder_count(self.__printer_type, self.__status())
 
     def get_tool_count(self):
-        if self.__printer_type == 2:
-            request = requests.get(f'{self.__printer_url}/rr_status?type=2')
-            reply = json.loads(request.text)
-            return len(reply['tools'])
-
-        elif self.__printer_type == 3:
-            request = requests.get(f'{self.__printer_url}/machine/status')
-            reply = json.loads(request.text)
-            return len(reply['tools'])
+        return parse_tool_count(self.__printer_type, self.__status())
 
     def get_status(self):
-        if self.__printer_type == 2:
-            request = requests.get(f'{self.__printer_url}/rr_status?type=2')
-            reply = json.loads(request.text)
-            status = reply['status']
-            if 'I' in status:
-                return 'idle'
-            elif 'P' in status:
-                return 'processing'
-            elif 'S' in status:
-                return 'paused'
-            elif 'B' in status:
-                return 'cancelling'
-            else:
-                return status
+        return parse_status(self.__printer_type, self.__status())
 
-        elif self.__printer_type == 3:
-            request = requests.get(f'{self.__printer_url}/machine/status')
-            reply = json.loads(request.text)
-            return len(reply['state']['status'])
+    def get_current_tool(self):
+        return parse_current_tool(self.__printer_type, self.__status())
 
     def g_code(self, command):
         request = None
 
         if self.__printer_type == 2:
-            request = requests.get(f'{self.__printer_url}/rr_gcode?gcode={command}')
+            request = self.__get('rr_gcode', params={'gcode': command})
 
         elif self.__printer_type == 3:
-            request = requests.post(f'{self.__printer_url}/machine/code/', data=command)
+            request = self.__post('machine/code/', data=command)
+
+        # Whatever the command did, cached status is now stale
+        self.snapshot.invalidate()
 
         if request.ok:
             return 0
@@ -141,27 +263,129 @@ class DuetWebAPI:
             print(request.reason)
             return request.status_code
 
-    def get_file(self, filename):
-        request = None
+    def send_g_codes(self, commands, wait=False, timeout=60, position=None, start_timeout=0.5):
+        if isinstance(commands, str):
+            commands = [commands]
+        commands = list(commands)
+        if wait:
+            # M400 holds the reply until all moves have finished
+            commands.append('M400')
+
+        max_length = RRF2_MAX_GCODE_LENGTH if self.__printer_type == 2 else None
+        replies = []
+        for block in batch_g_codes(commands, max_length):
+            if self.__printer_type == 2:
+                request = self.__get('rr_gcode', params={'gcode': block})
+                request.raise_for_status()
+            else:
+                request = self.__session.post(f'{self.__printer_url}/machine/code/', data=block, timeout=max(self.timeout, timeout))
+                request.raise_for_status()
+                replies.append(request.text)
+
+        self.snapshot.invalidate()
 
         if self.__printer_type == 2:
-            request = requests.get(f'{self.__printer_url}/rr_download?name={filename}')
+            if wait:
+                # rr_gcode only queues the commands, the board can still report idle before it starts on them
+                self.wait_until_idle(timeout, position, start_timeout=None if position is not None else start_timeout)
+            replies.append(self.__get('rr_reply').text)
 
-        elif self.__printer_type == 3:
-            request = requests.get(f'{self.__printer_url}/machine/file/{filename}')
+        return '\n'.join(reply for reply in replies if reply)
+
+    def wait_until_idle(self, timeout=60, position=None, tolerance=0.01, initial_delay=0.01, max_delay=0.25, backoff=1.5,
+                        start_timeout=None):
+        # With start_timeout, idle only counts once the board was seen busy or start_timeout has passed,
+        # for commands that were just queued and may not have started yet
+        start = time.monotonic()
+        deadline = start + timeout
+        started = start_timeout is None
+        delay = initial_delay
+        while True:
+            self.snapshot.invalidate()
+            if self.get_status() != 'idle':
+                started = True
+            elif started or time.monotonic() - start >= start_timeout:
+                coords = self.get_coords()
+                if position is None or all(abs(coords[axis] - value) <= tolerance for axis, value in position.items()):
+                    return coords
+
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f'Printer did not become idle within {timeout}s')
+            # Short moves finish in a few polls, long ones back off to avoid hammering the board
+            time.sleep(delay)
+            delay = min(delay * backoff, max_delay)
+
+    def get_file_info(self, filename):
+        try:
+            if self.__printer_type == 2:
+                request = self.__get('rr_fileinfo', params={'name': filename})
+            else:
+                request = self.__get(f'machine/fileinfo/{quote(filename)}')
+            request.raise_for_status()
+            reply = json.loads(request.text)
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+        if reply.get('err', 0) != 0 or 'size' not in reply:
+            return None
+        return reply
 
-        return request.text.splitlines()
+    def __download(self, filename):
+        if self.__printer_type == 2:
+            return self.__get('rr_download', params={'name': filename}, stream=True)
+        return self.__get(f'machine/file/{quote(filename)}', stream=True)
+
+    def iter_file(self, filename, lines=True, chunk_size=65536, use_cache=True):
+        cache_path = None
+        if use_cache and self.file_cache is not None:
+            info = self.get_file_info(filename)
+            if info is not None:
+                cache_path = self.file_cache.path(self.__printer_url, filename, info['size'], info.get('lastModified'))
+
+        if cache_path is not None and os.path.exists(cache_path):
+            chunks = iter_file_chunks(cache_path, chunk_size)
+            yield from iter_lines_from_chunks(chunks) if lines else chunks
+            return
+
+        with self.__download(filename) as request:
+            request.raise_for_status()
+            chunks = request.iter_content(chunk_size)
+
+            if cache_path is None:
+                yield from iter_lines_from_chunks(chunks) if lines else chunks
+                return
+
+            # Fill the cache while the caller consumes the stream, only publishing complete downloads
+            partial_path = f'{cache_path}.part'
+            try:
+                with open(partial_path, 'wb') as cache_file:
+                    def write_through():
+                        for chunk in chunks:
+                            cache_file.write(chunk)
+                            yield chunk
+
+                    yield from iter_lines_from_chunks(write_through()) if lines else write_through()
+                os.replace(partial_path, cache_path)
+            finally:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+
+    def get_file(self, filename):
+        return list(self.iter_file(filename))
 
     def get_temperatures(self):
         if self.__printer_type == 2:
-            # request = requests.get(f'{self.__printer_url}/rr_status?type=2')
-            # reply = json.loads(request.text)
-            return 'Error: get_temperatures no implemented for RRF2 printers'
+            return parse_temperatures(self.__printer_type, None)
+        return parse_temperatures(self.__printer_type, self.__status())
 
-        elif self.__printer_type == 3:
-            request = requests.get(f'{self.__printer_url}/machine/status')
-            reply = json.loads(request.text)
-            return reply['sensors']['analog']
+    def close(self):
+        self.__session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def test_all(self):
         print(self.printer_type())
@@ -0,0 +1,299 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+import threading
+import argparse
+import random
+import queue
+import json
+import time
+import math
+import re
+import sys
+
+
+GCODE_WORD = re.compile(r'([A-Z])\s*(-?\d*\.?\d+)')
+
+
+class SimulatedPrinter:
+    def __init__(self, firmware=3, tools=4, axes='XYZ', speed=100.0, tool_change_time=1.0, heaters=None, files=None,
+                 gcode_delay=0.05):
+        self.firmware = firmware
+        self.axes = axes
+        self.speed = speed
+        self.tool_change_time = tool_change_time
+        # RRF2 answers rr_gcode straight away and only starts on the commands a little later
+        self.gcode_delay = gcode_delay
+
+        self.offsets = [[0.0] * len(axes) for _ in range(tools)]
+        self.current_tool = -1
+        self.temperatures = heaters if heaters is not None else [25.0] * (tools + 1)
+        self.files = files if files is not None else {'sys/config.g': 'M550 P"Simulator"\n'}
+        self.files_modified = {name: time.strftime('%Y-%m-%dT%H:%M:%S') for name in self.files}
+        self.reply = ''
+
+        self.__start_position = [0.0] * len(axes)
+        self.__target_position = [0.0] * len(axes)
+        self.__move_start = 0.0
+        self.__move_end = 0.0
+        self.__lock = threading.Lock()
+
+        self.__gcode_queue = queue.Queue()
+        self.__gcode_thread = None
+
+    def position(self):
+        with self.__lock:
+            now = time.monotonic()
+            if now >= self.__move_end:
+                return list(self.__target_position)
+            if now <= self.__move_start:
+                return list(self.__start_position)
+            fraction = (now - self.__move_start) / (self.__move_end - self.__move_start)
+            return [a + (b - a) * fraction for a, b in zip(self.__start_position, self.__target_position)]
+
+    def busy(self):
+        return time.monotonic() < self.__move_end
+
+    def wait_for_moves(self):
+        delay = self.__move_end - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def __queue_move(self, target, duration):
+        with self.__lock:
+            # Moves run back to back, each starting where the previous one ends
+            now = max(time.monotonic(), self.__move_end)
+            self.__start_position = self.__target_position
+            self.__target_position = target
+            self.__move_start = now
+            self.__move_end = now + duration
+
+    def user_position(self):
+        # User coordinates are machine coordinates shifted by the active tool's offset
+        offsets = self.offsets[self.current_tool] if self.current_tool >= 0 else [0.0] * len(self.axes)
+        return [p + o for p, o in zip(self.position(), offsets)]
+
+    def execute(self, command):
+        replies = []
+        for line in command.splitlines():
+            line = line.split(';')[0].strip().upper()
+            if not line:
+                continue
+            words = dict((letter, float(value)) for letter, value in GCODE_WORD.findall(line))
+            code = line.split()[0]
+
+            if code in ('G0', 'G1'):
+                offsets = self.offsets[self.current_tool] if self.current_tool >= 0 else [0.0] * len(self.axes)
+                machine_target = list(self.__target_position)
+                for i, axis in enumerate(self.axes):
+                    if axis in words:
+                        machine_target[i] = words[axis] - offsets[i]
+                distance = math.dist(self.__target_position, machine_target)
+                self.__queue_move(machine_target, distance / self.speed)
+
+            elif code == 'G10' and 'P' in words:
+                tool = int(words['P'])
+                for i, axis in enumerate(self.axes):
+                    if axis in words:
+                        self.offsets[tool][i] = words[axis]
+
+            elif code.startswith('T'):
+                if code == 'T':
+                    replies.append(f'Tool {self.current_tool} is selected')
+                else:
+                    self.wait_for_moves()
+                    self.current_tool = int(float(code[1:]))
+                    self.__queue_move(list(self.__target_position), self.tool_change_time)
+
+            elif code == 'M400':
+                self.wait_for_moves()
+
+            elif code == 'M114':
+                replies.append(' '.join(f'{axis}:{value:.3f}' for axis, value in zip(self.axes, self.user_position())))
+
+        self.reply = '\n'.join(replies)
+        return self.reply
+
+    def submit(self, command):
+        with self.__lock:
+            if self.__gcode_thread is None:
+                self.__gcode_thread = threading.Thread(target=self.__run_queued, daemon=True)
+                self.__gcode_thread.start()
+        self.__gcode_queue.put((time.monotonic() + self.gcode_delay, command))
+
+    def __run_queued(self):
+        while True:
+            start, command = self.__gcode_queue.get()
+            delay = start - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.execute(command)
+
+    def rrf2_status(self, status_type):
+        reply = {
+            'status': 'B' if self.busy() else 'I',
+            'coords': {'xyz': self.user_position(), 'extr': [0.0] * len(self.offsets)},
+            'axisNames': self.axes,
+            'currentTool': self.current_tool,
+            'temps': {'current': list(self.temperatures)},
+            'tools': [{'number': i, 'offsets': list(offsets)} for i, offsets in enumerate(self.offsets)],
+        }
+        if status_type == 3:
+            reply['currentLayer'] = 0
+        return reply
+
+    def rrf3_status(self):
+        axes = [{'letter': axis, 'userPosition': value} for axis, value in zip(self.axes, self.user_position())]
+        return {
+            'state': {'status': 'busy' if self.busy() else 'idle', 'currentTool': self.current_tool},
+            'axes': axes,
+            'move': {'axes': axes, 'extruders': [{}] * len(self.offsets)},
+            'tools': [{'number': i, 'offsets': list(offsets)} for i, offsets in enumerate(self.offsets)],
+            'job': {'layer': None},
+            'sensors': {'analog': [{'lastReading': value} for value in self.temperatures]},
+        }
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, with Nagle on every keep-alive reply waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, code, body, content_type='application/json'):
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.bandwidth:
+            # Boards serve files far slower than loopback, which is what a file cache saves
+            time.sleep(len(body) / self.server.bandwidth)
+        self.wfile.write(body)
+
+    def simulate_network(self):
+        self.server.requests += 1
+        if self.server.latency > 0:
+            time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.server.error_rate:
+            self.send(500, {'err': 'injected error'})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.simulate_network():
+            return
+
+        printer = self.server.printer
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = unquote(url.path)
+
+        if printer.firmware == 2 and path == '/rr_status':
+            self.send(200, printer.rrf2_status(int(query.get('type', 1))))
+        elif printer.firmware == 2 and path == '/rr_gcode':
+            printer.submit(query.get('gcode', ''))
+            self.send(200, {'buff': 255})
+        elif printer.firmware == 2 and path == '/rr_reply':
+            self.send(200, printer.reply, 'text/plain')
+        elif printer.firmware == 2 and path == '/rr_download':
+            self.send_file(query.get('name', ''))
+        elif printer.firmware == 2 and path == '/rr_fileinfo':
+            self.send_file_info(query.get('name', ''))
+        elif printer.firmware == 3 and path == '/machine/status':
+            self.send(200, printer.rrf3_status())
+        elif printer.firmware == 3 and path.startswith('/machine/file/'):
+            self.send_file(path[len('/machine/file/'):])
+        elif printer.firmware == 3 and path.startswith('/machine/fileinfo/'):
+            self.send_file_info(path[len('/machine/fileinfo/'):])
+        else:
+            self.send(404, {'err': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode()
+        if not self.simulate_network():
+            return
+
+        printer = self.server.printer
+        if printer.firmware == 3 and urlsplit(self.path).path.rstrip('/') == '/machine/code':
+            self.send(200, printer.execute(body), 'text/plain')
+        else:
+            self.send(404, {'err': 'not found'})
+
+    def send_file(self, name):
+        printer = self.server.printer
+        if name in printer.files:
+            self.send(200, printer.files[name], 'application/octet-stream')
+        else:
+            self.send(404, {'err': 'not found'})
+
+    def send_file_info(self, name):
+        printer = self.server.printer
+        if name in printer.files:
+            self.send(200, {'err': 0, 'size': len(printer.files[name].encode()), 'lastModified': printer.files_modified[name]})
+        elif printer.firmware == 2:
+            self.send(200, {'err': 1})
+        else:
+            self.send(404, {'err': 'not found'})
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, printer, latency=0.0, error_rate=0.0, bandwidth=None):
+        ThreadingHTTPServer.__init__(self, address, SimulatorRequestHandler)
+        self.printer = printer
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.requests = 0
+
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is normal, not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+def start_simulator(printer=None, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, bandwidth=None):
+    server = SimulatorServer((host, port), printer or SimulatedPrinter(), latency, error_rate, bandwidth)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a simulated Duet board for DuetWebAPI')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--firmware', type=int, choices=[2, 3], default=3)
+    parser.add_argument('--tools', type=int, default=4)
+    parser.add_argument('--axes', default='XYZ')
+    parser.add_argument('--speed', type=float, default=100.0, help='travel speed in mm/s')
+    parser.add_argument('--gcode-delay', type=float, default=0.05, help='seconds before RRF2 starts on queued G-code')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean injected latency per request in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 500')
+    parser.add_argument('--bandwidth-kb', type=float, help='response bandwidth in KiB/s, unlimited by default')
+    args = parser.parse_args(argv)
+
+    printer = SimulatedPrinter(args.firmware, args.tools, args.axes, args.speed, gcode_delay=args.gcode_delay)
+    bandwidth = args.bandwidth_kb * 1024 if args.bandwidth_kb else None
+    server = SimulatorServer((args.host, args.port), printer, args.latency, args.error_rate, bandwidth)
+    print(f'Simulated RRF{args.firmware} board on {server.url()}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
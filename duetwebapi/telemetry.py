@@ -0,0 +1,115 @@
+from duetwebapi.duetwebapi import status_path
+import numpy as np
+import threading
+import requests
+import time
+
+
+def read_temperatures(api):
+    if api.printer_type() == 2:
+        reply = api.snapshot.get(status_path(2))
+        return reply.get('temps', {}).get('current', [])
+    return [sensor['lastReading'] if sensor else np.nan for sensor in api.get_temperatures()]
+
+
+class TelemetryPoller(threading.Thread):
+    def __init__(self, api, rate=10, capacity=1024, axes='XYZ', heaters=8):
+        self.api = api
+        self.period = 1 / rate
+        self.capacity = capacity
+        self.axes = axes
+        self.heaters = heaters
+
+        self.dtype = np.dtype([
+            ('timestamp', 'f8'),
+            ('sequence', 'i8'),
+            ('coords', 'f8', (len(axes),)),
+            ('tool', 'i4'),
+            ('status', 'U16'),
+            ('temperatures', 'f8', (heaters,)),
+        ])
+        self.buffer = np.zeros(capacity, dtype=self.dtype)
+
+        self.errors = 0
+        self.last_error = None
+
+        self.__count = 0
+        self.__latest = None
+        self.__subscribers = []
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+
+        threading.Thread.__init__(self, daemon=True)
+
+    def run(self):
+        while not self.__stop.is_set():
+            poll_start = time.monotonic()
+            try:
+                self.poll()
+            except (requests.exceptions.RequestException, KeyError, ValueError) as error:
+                self.errors += 1
+                self.last_error = error
+            self.__stop.wait(max(self.period - (time.monotonic() - poll_start), 0))
+
+    def poll(self):
+        # Every getter below is served from one fresh status fetch
+        self.api.snapshot.invalidate()
+        coords = self.api.get_coords()
+        tool = self.api.get_current_tool()
+        status = self.api.get_status()
+        temperatures = read_temperatures(self.api)
+
+        sample = np.zeros((), dtype=self.dtype)
+        sample['timestamp'] = time.monotonic()
+        sample['sequence'] = self.__count
+        sample['coords'] = [coords.get(axis, np.nan) for axis in self.axes]
+        sample['tool'] = tool if tool is not None else -1
+        sample['status'] = status
+        sample['temperatures'] = np.nan
+        temperatures = temperatures[:self.heaters]
+        sample['temperatures'][:len(temperatures)] = temperatures
+
+        with self.__lock:
+            previous = self.__latest
+            self.buffer[self.__count % self.capacity] = sample
+            self.__count += 1
+            self.__latest = sample
+
+        changed = previous is None or previous['tool'] != sample['tool'] or previous['status'] != sample['status'] \
+            or not np.array_equal(previous['coords'], sample['coords'])
+        for callback, on_change_only in list(self.__subscribers):
+            if changed or not on_change_only:
+                callback(sample)
+        return sample
+
+    def latest(self):
+        # Samples are never mutated after publishing, so readers don't need the lock
+        return self.__latest
+
+    def history(self, count=None):
+        with self.__lock:
+            available = min(self.__count, self.capacity)
+            count = available if count is None else min(count, available)
+            indices = (self.__count - count + np.arange(count)) % self.capacity
+            return self.buffer[indices].copy()
+
+    def sample_at(self, timestamp):
+        samples = self.history()
+        if samples.size == 0:
+            return None
+        index = np.searchsorted(samples['timestamp'], timestamp)
+        if index == 0:
+            return samples[0]
+        if index == samples.size:
+            return samples[-1]
+        before, after = samples[index - 1], samples[index]
+        return before if timestamp - before['timestamp'] <= after['timestamp'] - timestamp else after
+
+    def subscribe(self, callback, on_change_only=True):
+        self.__subscribers.append((callback, on_change_only))
+
+    def unsubscribe(self, callback):
+        self.__subscribers = [entry for entry in self.__subscribers if entry[0] is not callback]
+
+    def close(self):
+        self.__stop.set()
@@ -7,43 +7,13 @@ Layout:
         User Input
 """
 
+from tamv_pipeline.overlay import Overlay
 from PIL import ImageTk, Image
 import tkinter
 import cv2
 import numpy as np
 
 
-class Overlay:
-    def __init__(self):
-        self.overlays = []
-
-    def draw(self, frame):
-        for overlay in self.overlays:
-            if overlay[0] == 'circle':
-                frame = cv2.circle(frame, *tuple(overlay[1:]))
-
-            elif overlay[0] == 'crosshair0':
-                frame = cv2.line(frame,
-                                 (overlay[1][0] - overlay[2], overlay[1][1]),
-                                 (overlay[1][0] + overlay[2], overlay[1][1]),
-                                 overlay[3], overlay[4])
-                frame = cv2.line(frame,
-                                 (overlay[1][0], overlay[1][1] - overlay[2]),
-                                 (overlay[1][0], overlay[1][1] + overlay[2]),
-                                 overlay[3], overlay[4])
-
-        return frame
-
-    def clear(self):
-        self.overlays = []
-
-    def add_circle(self, position, radius, color=(255, 0, 0), stroke=1):
-        self.overlays.append(['circle', position, radius, color, stroke])
-
-    def add_crosshair(self, position, radius, color=(255, 0, 0), stroke=1, style=0):
-        self.overlays.append([f'crosshair{style}', position, radius, color, stroke])
-
-
 class VideoCapture:
     def __init__(self, video_source=0):
         self.stream = cv2.VideoCapture(video_source)
@@ -90,16 +60,18 @@ class Window:
         self.frame = self.stream.get_frame()
 
         # Search algorithms here
-        self.overlay.clear()
+        keypoints = []
+        radii = []
         grayscale = cv2.cvtColor(self.frame, cv2.COLOR_RGB2GRAY)
         circles = cv2.HoughCircles(grayscale, cv2.HOUGH_GRADIENT, 1.2, 100)
         if circles is not None:
             circles = np.round(circles[0, :]).astype('int')
             for (x, y, r) in circles:
-                self.overlay.add_circle((x, y), r, (0, 255, 0))
+                keypoints.append((x, y))
+                radii.append(r)
         # Done
 
-        self.frame = self.overlay.draw(self.frame)
+        self.frame = self.overlay.draw(self.frame, keypoints, radii=radii)
 
         if self.frame is not None:
             self.frame = ImageTk.PhotoImage(image=Image.fromarray(self.frame))
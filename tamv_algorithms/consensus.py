@@ -0,0 +1,82 @@
+from tamv_pipeline.stage import Stage
+import numpy as np
+
+
+CAPACITY = 100
+
+
+def estimate(samples, outlier_mads, tolerance):
+    median = np.median(samples, axis=0)
+    deviations = np.hypot(samples[:, 0] - median[0], samples[:, 1] - median[1])
+    # 1.4826 scales the MAD to a standard deviation for normally distributed noise
+    threshold = max(outlier_mads * 1.4826 * np.median(deviations), tolerance)
+    inliers = deviations <= threshold
+
+    robust_centre = samples[inliers].mean(axis=0)
+    spread = np.hypot(samples[inliers, 0] - robust_centre[0], samples[inliers, 1] - robust_centre[1]).max()
+    return robust_centre, inliers, spread
+
+
+class Consensus(Stage):
+    settings = {
+        'window': [15, 'slider', 3, 100],  # detections kept for the estimate
+        'min_samples': [5, 'slider', 3, 100],
+        'outlier_mads': [3, 'slider', 1, 10],  # rejection threshold in robust standard deviations
+        'tolerance_tenths_px': [5, 'slider', 1, 50]  # converged once all inliers sit this close to the centre
+    }
+
+    def reset(self):
+        # Ring buffer of (x, y) detections
+        self.history = np.zeros((CAPACITY, 2), dtype=np.float64)
+        self.head = 0
+        self.count = 0
+        self.centre = None
+
+    def push(self, point):
+        self.history[self.head] = point
+        self.head = (self.head + 1) % CAPACITY
+        self.count = min(self.count + 1, CAPACITY)
+
+    def process(self, frame, info):
+        settings = self.snapshot
+        keypoints = info.keypoints
+        radii = None
+
+        if keypoints:
+            points = np.asarray(keypoints, dtype=np.float64)[:, :2]
+            closest = 0
+            if self.centre is not None and len(points) > 1:
+                closest = int(np.argmin(np.hypot(points[:, 0] - self.centre[0], points[:, 1] - self.centre[1])))
+            self.push(points[closest])
+            # The centre is drawn with the radius of the detection it was just fed
+            if info.radii is not None and len(info.radii) == len(keypoints):
+                radii = [info.radii[closest]]
+
+        samples_used = min(self.count, settings['window'])
+        tolerance = settings['tolerance_tenths_px'] / 10
+        converged = False
+        inlier_count = 0
+        spread = None
+        if samples_used > 0:
+            samples = self.history[(self.head - 1 - np.arange(samples_used)) % CAPACITY]
+            self.centre, inliers, spread = estimate(samples, settings['outlier_mads'], tolerance)
+            inlier_count = int(np.count_nonzero(inliers))
+            # A frame without a detection only repeats history, it never counts as a converged fix
+            converged = bool(
+                keypoints
+                and samples_used >= settings['min_samples']
+                and inlier_count * 2 > samples_used
+                and spread <= tolerance
+            )
+
+        centre = self.centre
+        centre_keypoints = [(float(centre[0]), float(centre[1]))] if centre is not None else []
+        return frame, info.replace(raw_keypoints=keypoints, keypoints=centre_keypoints, radii=radii, consensus={
+            'centre': centre_keypoints[0] if centre is not None else None,
+            'converged': converged,
+            # Whether this frame contributed a detection
+            'fresh': bool(keypoints),
+            'samples': samples_used,
+            'inliers': inlier_count,
+            'spread': float(spread) if spread is not None else None,
+        })
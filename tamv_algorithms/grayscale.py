@@ -1,9 +1,12 @@
+from tamv_pipeline.compiler import convert
+from tamv_pipeline.stage import Stage
 
-import cv2
 
+class Grayscale(Stage):
+    # Pure conversion, the chain compiler folds it into the next stage that needs gray frames
+    input_colorspaces = ('BGR', 'RGB', 'GRAY')
+    output_colorspace = 'GRAY'
+    conversion_only = True
 
-settings = {}
-
-
-def process(frame, args):
-    return cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY), ({'keypoints': None, 'blur': 11})
+    def process(self, frame, info):
+        return convert(frame, info.colorspace, 'GRAY'), info.replace(colorspace='GRAY')
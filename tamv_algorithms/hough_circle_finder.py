@@ -1,16 +1,76 @@
-
+from tamv_pipeline.stage import Stage
 import numpy as np
 import cv2
 
 
-settings = {}
+def find_circles(frame, offset_x=0, offset_y=0, min_radius=0, max_radius=0):
+    circles = cv2.HoughCircles(frame, cv2.HOUGH_GRADIENT, 1.2, 100, minRadius=min_radius, maxRadius=max_radius)
+    if circles is None:
+        return None
+    circles = circles[0, :]
+    circles[:, 0] += offset_x
+    circles[:, 1] += offset_y
+    return circles
+
+
+def find_circles_roi(frame, detection, margin):
+    x, y, r = detection
+    half_size = int(r * 1.5 + margin)
+    x0, y0 = max(int(x) - half_size, 0), max(int(y) - half_size, 0)
+    x1, y1 = min(int(x) + half_size + 1, frame.shape[1]), min(int(y) + half_size + 1, frame.shape[0])
+    if x1 - x0 < 2 * r or y1 - y0 < 2 * r:
+        return None
+
+    return find_circles(frame[y0:y1, x0:x1], x0, y0, max(int(r * 0.75), 1), int(r * 1.25) + 1)
+
+
+class HoughCircleFinder(Stage):
+    settings = {
+        'tracking': [False, 'checkbox', False, True],
+        'roi_margin': [20, 'slider', 0, 200],  # pixels the nozzle may move between frames
+        'full_search_interval': [30, 'slider', 1, 300]  # frames between forced full-frame searches
+    }
+
+    input_colorspaces = ('GRAY',)
+    expensive = True
+
+    def reset(self):
+        # Tracking state, (x, y, r) of the last detection
+        self.last_detection = None
+        self.frames_since_full_search = 0
+
+    def process(self, frame, info):
+        settings = self.snapshot
+
+        circles = None
+        search = 'full'
+        if settings['tracking'] and self.last_detection is not None and self.frames_since_full_search < settings['full_search_interval']:
+            circles = find_circles_roi(frame, self.last_detection, settings['roi_margin'])
+            if circles is not None:
+                search = 'roi'
+                self.frames_since_full_search += 1
+
+        if circles is None:
+            circles = find_circles(frame)
+            self.frames_since_full_search = 0
+
+        keypoints = []
+        radii = []
+        if circles is not None:
+            if self.last_detection is not None and len(circles) > 1:
+                # Keep following the circle closest to the previous detection
+                distances = np.hypot(circles[:, 0] - self.last_detection[0], circles[:, 1] - self.last_detection[1])
+                circles = circles[np.argsort(distances)]
+            self.last_detection = tuple(float(value) for value in circles[0])
+
+            circles = np.round(circles).astype('int')
+            for (x, y, r) in circles:
+                keypoints.append((x, y))
+                radii.append(r)
+        else:
+            self.last_detection = None
 
+        if not settings['tracking']:
+            self.last_detection = None
 
-def process(frame, args):
-    circles = cv2.HoughCircles(frame, cv2.HOUGH_GRADIENT, 1.2, 100)
-    keypoints = []
-    if circles is not None:
-        circles = np.round(circles[0, :]).astype('int')
-        for (x, y, r) in circles:
-            keypoints.append((x, y))
-    return frame, {'keypoints': keypoints}
+        return frame, info.replace(keypoints=keypoints, radii=radii, search=search)
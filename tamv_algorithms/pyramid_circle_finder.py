@@ -0,0 +1,80 @@
+from tamv_pipeline.stage import Stage
+import numpy as np
+import cv2
+
+
+def fit_circle(xs, ys):
+    # Algebraic least-squares (Kasa) fit: x^2 + y^2 = 2ax + 2by + c
+    a = np.column_stack((2 * xs, 2 * ys, np.ones_like(xs)))
+    b = xs * xs + ys * ys
+    (cx, cy, c), _, rank, _ = np.linalg.lstsq(a, b, rcond=None)
+    if rank < 3:
+        return None
+    radius_squared = c + cx * cx + cy * cy
+    if radius_squared <= 0:
+        return None
+    return cx, cy, np.sqrt(radius_squared)
+
+
+def refine_circle(frame, x, y, r, band, edge_threshold, iterations=2):
+    half_size = int(r + band + 2)
+    x0, y0 = max(int(x) - half_size, 0), max(int(y) - half_size, 0)
+    x1, y1 = min(int(x) + half_size + 1, frame.shape[1]), min(int(y) + half_size + 1, frame.shape[0])
+
+    edges = cv2.Canny(frame[y0:y1, x0:x1], edge_threshold // 2, edge_threshold)
+    edge_ys, edge_xs = np.nonzero(edges)
+    edge_xs = edge_xs.astype(np.float64) + x0
+    edge_ys = edge_ys.astype(np.float64) + y0
+
+    cx, cy, cr = x, y, r
+    for _ in range(iterations):
+        selected = np.abs(np.hypot(edge_xs - cx, edge_ys - cy) - cr) <= band
+        if np.count_nonzero(selected) < 8:
+            break
+
+        fit = fit_circle(edge_xs[selected], edge_ys[selected])
+        if fit is None:
+            break
+        cx, cy, cr = fit
+        band = max(band / 2, 1)
+
+    if np.hypot(cx - x, cy - y) > r / 2:
+        # The fit latched onto something else, trust the coarse detection instead
+        return x, y, r
+    return cx, cy, cr
+
+
+class PyramidCircleFinder(Stage):
+    settings = {
+        'pyramid_levels': [2, 'slider', 0, 4],  # each level halves the resolution of the coarse search
+        'refine': [True, 'checkbox', False, True],
+        'edge_threshold': [100, 'slider', 1, 255],  # Canny upper threshold used for refinement
+        'refine_band': [4, 'slider', 1, 20]  # pixels either side of the coarse radius to take edge points from
+    }
+
+    input_colorspaces = ('GRAY',)
+    expensive = True
+
+    def process(self, frame, info):
+        settings = self.snapshot
+        levels = settings['pyramid_levels']
+        scale = 1 << levels
+
+        small = frame
+        for _ in range(levels):
+            small = cv2.pyrDown(small)
+
+        circles = cv2.HoughCircles(small, cv2.HOUGH_GRADIENT, 1.2, max(100 // scale, 1), param2=max(100 // scale, 15))
+
+        keypoints = []
+        radii = []
+        if circles is not None:
+            for (x, y, r) in circles[0, :] * scale:
+                if settings['refine']:
+                    # The coarse radius is only good to about one coarse pixel
+                    band = max(settings['refine_band'], scale)
+                    x, y, r = refine_circle(frame, x, y, r, band, settings['edge_threshold'])
+                keypoints.append((float(x), float(y)))
+                radii.append(float(r))
+
+        return frame, info.replace(keypoints=keypoints, radii=radii, search='pyramid')
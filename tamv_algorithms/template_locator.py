@@ -0,0 +1,178 @@
+from tamv_pipeline.stage import Stage
+import numpy as np
+import cv2
+
+
+def subpixel_offset(before, peak, after):
+    # Vertex of the parabola through three samples around the peak
+    denominator = before - 2 * peak + after
+    if denominator >= 0:
+        return 0.0
+    return float(np.clip(0.5 * (before - after) / denominator, -0.5, 0.5))
+
+
+def normalise_spectrum(spectrum):
+    # Phase only, spectrum / |spectrum| without leaving the CCS packing, the imaginary parts of |spectrum|^2 are zero
+    magnitude = cv2.mulSpectrums(spectrum, spectrum, 0, conjB=True)
+    cv2.sqrt(magnitude, magnitude)
+    return cv2.divSpectrums(spectrum, magnitude, 0)
+
+
+def prepare_template(template, shape):
+    # Zero mean so the template spectrum carries no DC term, padded out to the search window's DFT size
+    padded = np.zeros(shape, dtype=np.float32)
+    padded[:template.shape[0], :template.shape[1]] = template - template.mean()
+    return cv2.dft(padded)
+
+
+def phase_correlate(window, template_spectrum, padded):
+    # padded is reused between frames, only the window's corner is ever written so the rest stays zero
+    height, width = window.shape
+    region = padded[:height, :width]
+    region[...] = window
+    region -= region.mean()
+
+    cross = cv2.mulSpectrums(cv2.dft(padded), template_spectrum, 0, conjB=True)
+    return cv2.idft(normalise_spectrum(cross), flags=cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE)
+
+
+class TemplateLocator(Stage):
+    settings = {
+        'template_size': [96, 'slider', 16, 320],  # pixels, square, used when nothing upstream reports a radius
+        'recapture': [False, 'checkbox', False, True],  # every toggle takes a new template from the next frame
+        'min_response': [7, 'slider', 0, 100],  # hundredths of a perfect correlation peak, after scaling by window size
+        'pyramid_levels': [0, 'slider', 0, 3],  # each level halves the resolution the correlation runs at
+        'acquire_levels': [2, 'slider', 0, 3],  # further levels down for full-frame searches, the match is then refined
+        'tracking': [True, 'checkbox', False, True],
+        'roi_margin': [40, 'slider', 8, 200],  # pixels the nozzle may move between frames
+        'full_search_interval': [30, 'slider', 1, 300]  # frames between forced full-frame searches
+    }
+
+    input_colorspaces = ('GRAY',)
+    expensive = True
+
+    def reset(self):
+        self.template = None
+        # Position of the nozzle centre inside the template
+        self.template_centre = None
+        self.recapture = None
+        # Template spectra and zeroed pad buffers, one per search window shape
+        self.spectra = {}
+        self.pads = {}
+        # Tracking state, top left corner of the last match at full resolution
+        self.last_match = None
+        self.frames_since_full_search = 0
+
+    def capture_template(self, frame, centre, size=None):
+        size = int(size if size is not None else self.snapshot['template_size'])
+        x0 = int(np.clip(round(centre[0] - size / 2), 0, max(frame.shape[1] - size, 0)))
+        y0 = int(np.clip(round(centre[1] - size / 2), 0, max(frame.shape[0] - size, 0)))
+        self.template = frame[y0:y0 + size, x0:x0 + size].astype(np.float32)
+        self.template_centre = (centre[0] - x0, centre[1] - y0)
+        self.spectra = {}
+        self.last_match = None
+        self.recapture = self.snapshot['recapture']
+
+    def template_spectrum(self, shape, levels):
+        # The template never changes between captures, so its spectrum is computed once per window size
+        key = (shape, levels)
+        if key not in self.spectra:
+            template = self.template
+            for _ in range(levels):
+                template = cv2.pyrDown(template)
+            self.spectra[key] = prepare_template(template, shape)
+            self.pads[shape] = np.zeros(shape, dtype=np.float32)
+        return self.spectra[key]
+
+    def search_window(self, shape, levels):
+        # Fixed size around the last match, slid inside the frame rather than clipped so its spectrum stays cached
+        scale = 1 << levels
+        margin = self.snapshot['roi_margin'] // scale
+        height = self.template.shape[0] // scale + 2 * margin
+        width = self.template.shape[1] // scale + 2 * margin
+        if height >= shape[0] or width >= shape[1]:
+            return None
+        x0 = int(np.clip(self.last_match[0] / scale - margin, 0, shape[1] - width))
+        y0 = int(np.clip(self.last_match[1] / scale - margin, 0, shape[0] - height))
+        return x0, y0, width, height
+
+    def correlate(self, frame, window, levels):
+        x0, y0, width, height = window
+        shape = (cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width))
+        spectrum = self.template_spectrum(shape, levels)
+        correlation = phase_correlate(frame[y0:y0 + height, x0:x0 + width], spectrum, self.pads[shape])
+
+        _, peak, _, (x, y) = cv2.minMaxLoc(correlation)
+        rows, columns = correlation.shape
+        dx = subpixel_offset(correlation[y, x - 1], peak, correlation[y, (x + 1) % columns])
+        dy = subpixel_offset(correlation[y - 1, x], peak, correlation[(y + 1) % rows, x])
+
+        # The peak shrinks as the template covers less of the window, scaled back so one threshold fits
+        # a full frame at any resolution as well as a tracking window
+        template_area = self.template.size / (1 << levels) ** 2
+        response = peak * np.sqrt(width * height / template_area)
+        return response, x0 + x + dx, y0 + y + dy
+
+    def locate(self, frame, window, levels):
+        if window is None:
+            return None
+        response, x, y = self.correlate(frame, window, levels)
+        return (x, y) if response * 100 >= self.snapshot['min_response'] else None
+
+    def acquire(self, frame, levels):
+        # The whole frame is searched a few levels down, where the DFTs are a fraction of the size,
+        # and that match is refined in a tracking window at the working resolution
+        extra = 0
+        while extra < self.snapshot['acquire_levels'] and min(self.template.shape) >> (levels + extra + 1) >= 16:
+            extra += 1
+        coarse = frame
+        for _ in range(extra):
+            coarse = cv2.pyrDown(coarse)
+
+        match = self.locate(coarse, (0, 0, coarse.shape[1], coarse.shape[0]), levels + extra)
+        if match is None or extra == 0:
+            return match
+        self.last_match = (match[0] * (1 << (levels + extra)), match[1] * (1 << (levels + extra)))
+        window = self.search_window(frame.shape[:2], levels)
+        return self.locate(frame, window, levels) or (match[0] * (1 << extra), match[1] * (1 << extra))
+
+    def process(self, frame, info):
+        settings = self.snapshot
+
+        if self.template is None or settings['recapture'] != self.recapture:
+            # Upstream detections say where the nozzle is, otherwise it is expected under the crosshair
+            if info.keypoints:
+                centre = info.keypoints[0][:2]
+            else:
+                centre = (frame.shape[1] / 2, frame.shape[0] / 2)
+            # Sized from the detected radius so the template frames the nozzle and little else
+            size = int(info.radii[0] * 2.5) if info.radii else None
+            self.capture_template(frame, centre, size)
+
+        levels = settings['pyramid_levels']
+        scale = 1 << levels
+        small = frame
+        for _ in range(levels):
+            small = cv2.pyrDown(small)
+
+        search = 'template_roi'
+        match = None
+        if settings['tracking'] and self.last_match is not None and self.frames_since_full_search < settings['full_search_interval']:
+            match = self.locate(small, self.search_window(small.shape[:2], levels), levels)
+        if match is None:
+            search = 'template'
+            self.frames_since_full_search = 0
+            match = self.acquire(small, levels)
+        else:
+            self.frames_since_full_search += 1
+
+        keypoints = []
+        self.last_match = None
+        if match is not None:
+            self.last_match = (match[0] * scale, match[1] * scale)
+            keypoints.append((
+                float(self.last_match[0] + self.template_centre[0]),
+                float(self.last_match[1] + self.template_centre[1])
+            ))
+
+        return frame, info.replace(keypoints=keypoints, radii=None, search=search)
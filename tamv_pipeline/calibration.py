@@ -0,0 +1,353 @@
+import collections
+import numpy as np
+import threading
+import argparse
+import json
+import time
+import sys
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.__name = None
+        self.__start = None
+
+    def start(self, name):
+        self.stop()
+        self.__name = name
+        self.__start = time.monotonic()
+
+    def stop(self):
+        if self.__name is not None:
+            self.phases[self.__name] = self.phases.get(self.__name, 0.0) + time.monotonic() - self.__start
+            self.__name = None
+
+
+class Motion:
+    def __init__(self, target, tool=None):
+        # Target in user coordinates, {'X': ..., 'Y': ...}
+        self.target = target
+        self.tool = tool
+        self.sent = time.monotonic()
+        # Set once the machine is known to be stopped at the target
+        self.arrived = None
+        self.error = None
+        self.reset = False
+
+
+class ToolCalibration:
+    def __init__(self, tool):
+        self.tool = tool
+        self.offsets = None
+        self.previous_offsets = None
+        self.centred_position = None
+        self.error_px = None
+        self.iterations = 0
+        self.converged = False
+        self.phases = None
+        self.wall_time = 0.0
+
+    def to_dict(self):
+        return {
+            'tool': self.tool,
+            'offsets': self.offsets,
+            'previous_offsets': self.previous_offsets,
+            'centred_position': self.centred_position,
+            'error_px': self.error_px,
+            'iterations': self.iterations,
+            'converged': self.converged,
+            'phases': dict(self.phases) if self.phases else None,
+            'wall_time': self.wall_time,
+        }
+
+
+class CalibrationEngine:
+    def __init__(self, api, vision, camera_position, reference_position=None, target_px=None,
+                 tolerance_px=0.5, max_iterations=10, settle_time=0.1, samples=5, settle_tolerance_px=1.0,
+                 sample_timeout=3.0, feedrate=6000, calibration_jog=0.5, motion_timeout=60, write_offsets=False,
+                 telemetry=None, position_tolerance=0.01, poll_interval=0.02):
+        self.api = api
+        self.vision = vision
+        self.camera_position = camera_position
+        self.reference_position = reference_position
+        self.target_px = target_px
+
+        self.tolerance_px = tolerance_px
+        self.max_iterations = max_iterations
+        self.settle_time = settle_time
+        self.samples = samples
+        self.settle_tolerance_px = settle_tolerance_px
+        self.sample_timeout = sample_timeout
+        self.feedrate = feedrate
+        self.calibration_jog = calibration_jog
+        self.motion_timeout = motion_timeout
+        self.write_offsets = write_offsets
+        self.telemetry = telemetry
+        self.position_tolerance = position_tolerance
+        self.poll_interval = poll_interval
+
+        # Pixels per millimetre, columns are machine X and Y
+        self.pixels_per_mm = None
+
+        self.motion = None
+
+    def move_command(self, x, y):
+        return f'G1 X{x:.3f} Y{y:.3f} F{self.feedrate}'
+
+    def at_target(self, coords, motion):
+        return all(abs(coords[axis] - value) <= self.position_tolerance for axis, value in motion.target.items())
+
+    def on_telemetry(self, sample):
+        motion = self.motion
+        if motion is None or motion.arrived is not None or sample['timestamp'] < motion.sent:
+            return
+        if sample['status'] != 'idle' or (motion.tool is not None and sample['tool'] != motion.tool):
+            return
+        coords = dict(zip(self.telemetry.axes, sample['coords']))
+        if self.at_target(coords, motion):
+            motion.arrived = float(sample['timestamp'])
+
+    def wait_for_arrival(self, motion):
+        try:
+            while True:
+                remaining = motion.sent + self.motion_timeout - time.monotonic()
+                self.api.wait_until_idle(remaining, motion.target, self.position_tolerance)
+                # The previous tool may be idle at the same position before the tool change starts
+                if motion.tool is None or self.api.get_current_tool() == motion.tool:
+                    break
+                time.sleep(self.poll_interval)
+            motion.arrived = time.monotonic()
+        except Exception as error:
+            motion.error = error
+
+    def move(self, commands, x, y, tool=None):
+        # Returns as soon as the commands are sent, the vision pipeline keeps sampling while the machine moves
+        # and measure_centre picks up the first frames taken after it stopped
+        self.vision.reset_stages()
+        motion = Motion({'X': round(x, 3), 'Y': round(y, 3)}, tool)
+        self.motion = motion
+        self.api.send_g_codes(commands, timeout=self.motion_timeout)
+        if self.telemetry is None:
+            # Without telemetry, arrival is confirmed by position in the background
+            threading.Thread(target=self.wait_for_arrival, args=(motion,), daemon=True).start()
+        return motion
+
+    def closest_keypoint(self, keypoints, shape):
+        points = np.asarray(keypoints, dtype=np.float64)[:, :2]
+        if self.target_px is None:
+            self.target_px = (shape[1] / 2, shape[0] / 2)
+        distances = np.hypot(points[:, 0] - self.target_px[0], points[:, 1] - self.target_px[1])
+        return points[np.argmin(distances)]
+
+    def measure_centre(self, motion):
+        # Frames keep arriving while the machine moves and settles. The measurement is taken from the first
+        # frames captured settle_time after arrival, as soon as consecutive detections agree
+        motion_deadline = motion.sent + self.motion_timeout
+        deadline = None
+        sequence = 0
+        centres = []
+        while True:
+            if motion.error is not None:
+                raise motion.error
+
+            now = time.monotonic()
+            settled = None
+            if motion.arrived is not None:
+                settled = motion.arrived + self.settle_time
+                if deadline is None:
+                    deadline = settled + self.sample_timeout
+                if now >= deadline:
+                    break
+                if not motion.reset and now >= settled:
+                    # Tracking and consensus start over from frames of the stopped machine
+                    self.vision.reset_stages()
+                    motion.reset = True
+            elif now >= motion_deadline:
+                raise TimeoutError(f'Machine did not reach {motion.target} within {self.motion_timeout}s')
+
+            result = self.vision.wait_for_result(sequence, timeout=self.poll_interval)
+            if result is None:
+                continue
+            sequence = result.sequence
+            # Carried forward keypoints may come from a frame taken while the machine was still moving
+            if settled is None or result.keypoints_timestamp < settled or not result.keypoints:
+                continue
+            # A consensus stage at the end of the chain already knows when the estimate is good enough
+            if result.consensus is not None and result.consensus['converged']:
+                return np.asarray(result.consensus['centre'])
+
+            centres.append(self.closest_keypoint(result.keypoints, result.frame.shape))
+            recent = np.asarray(centres[-self.samples:])
+            if len(recent) == self.samples:
+                centre = np.median(recent, axis=0)
+                if np.hypot(recent[:, 0] - centre[0], recent[:, 1] - centre[1]).max() <= self.settle_tolerance_px:
+                    return centre
+
+        if not centres:
+            raise RuntimeError('No nozzle detected by the vision pipeline')
+        return np.median(np.asarray(centres[-self.samples:]), axis=0)
+
+    def calibrate_camera(self, position, centre):
+        x, y = position
+        jog = self.calibration_jog
+
+        centre_x = self.measure_centre(self.move([self.move_command(x + jog, y)], x + jog, y))
+        centre_y = self.measure_centre(self.move([self.move_command(x, y + jog)], x, y + jog))
+
+        self.pixels_per_mm = np.column_stack(((centre_x - centre) / jog, (centre_y - centre) / jog))
+        if abs(np.linalg.det(self.pixels_per_mm)) < 1e-6:
+            self.pixels_per_mm = None
+            raise RuntimeError('Nozzle did not move in the image during camera calibration')
+
+        return self.move([self.move_command(x, y)], x, y)
+
+    def calibrate_tool(self, tool, pending_commands):
+        calibration = ToolCalibration(tool)
+        timer = PhaseTimer()
+        tool_start = time.monotonic()
+
+        # Offsets for the previous tool ride along with this tool change
+        timer.start('tool_change')
+        x, y = self.camera_position['X'], self.camera_position['Y']
+        motion = self.move(pending_commands + ['G90', f'T{tool}', self.move_command(x, y)], x, y, tool)
+
+        timer.start('capture')
+        centre = self.measure_centre(motion)
+
+        if self.pixels_per_mm is None:
+            timer.start('camera_calibration')
+            motion = self.calibrate_camera((x, y), centre)
+            timer.start('capture')
+            centre = self.measure_centre(motion)
+
+        while True:
+            error = np.asarray(self.target_px) - centre
+            calibration.error_px = float(np.hypot(*error))
+            if calibration.error_px <= self.tolerance_px:
+                calibration.converged = True
+                break
+            if calibration.iterations >= self.max_iterations:
+                break
+
+            timer.start('jog')
+            delta_x, delta_y = np.linalg.solve(self.pixels_per_mm, error)
+            x, y = x + delta_x, y + delta_y
+            motion = self.move([self.move_command(x, y)], x, y)
+            calibration.iterations += 1
+
+            timer.start('capture')
+            centre = self.measure_centre(motion)
+
+        timer.start('compute')
+        self.api.snapshot.invalidate()
+        coords = self.api.get_coords()
+        current_offsets = self.api.get_g10_tool_offsets(tool)
+        calibration.previous_offsets = current_offsets
+        calibration.centred_position = {'X': coords['X'], 'Y': coords['Y']}
+
+        if self.reference_position is None:
+            # The first tool becomes the reference and keeps its current offsets
+            self.reference_position = dict(calibration.centred_position)
+
+        # Machine position is user position minus the active tool offset
+        calibration.offsets = {
+            axis: round(self.reference_position[axis] - (coords[axis] - current_offsets[axis]), 3)
+            for axis in ('X', 'Y')
+        }
+        timer.stop()
+
+        calibration.phases = timer.phases
+        calibration.wall_time = time.monotonic() - tool_start
+        return calibration
+
+    def run(self, tools=None, park=True):
+        if tools is None:
+            tools = range(self.api.get_tool_count())
+
+        if self.telemetry is not None:
+            # Every sample, a machine that was already at the target never changes state
+            self.telemetry.subscribe(self.on_telemetry, on_change_only=False)
+
+        results = []
+        pending_commands = []
+        try:
+            for tool in tools:
+                calibration = self.calibrate_tool(tool, pending_commands)
+                results.append(calibration)
+
+                pending_commands = []
+                if self.write_offsets and calibration.converged:
+                    pending_commands.append(f'G10 P{tool} X{calibration.offsets["X"]:.3f} Y{calibration.offsets["Y"]:.3f}')
+        finally:
+            self.motion = None
+            if self.telemetry is not None:
+                self.telemetry.unsubscribe(self.on_telemetry)
+            # Offsets already measured are still written, and a failed run never leaves a tool mounted
+            final_commands = pending_commands + (['T-1'] if park else [])
+            if final_commands:
+                self.api.send_g_codes(final_commands, wait=True, timeout=self.motion_timeout)
+
+        return results
+
+
+def main(argv=None):
+    from duetwebapi.duetwebapi import DuetWebAPI
+    from duetwebapi.telemetry import TelemetryPoller
+    from tamv_pipeline.pipeline import AlgorithmThread
+    from tamv_pipeline.capture import open_source
+
+    parser = argparse.ArgumentParser(description='Calibrate tool offsets with the camera and a Duet controlled machine')
+    parser.add_argument('printer', help='printer URL, e.g. http://192.168.1.10')
+    parser.add_argument('source', help='camera index or video source')
+    parser.add_argument('--camera-x', type=float, required=True, help='X position that puts the nozzle over the camera')
+    parser.add_argument('--camera-y', type=float, required=True, help='Y position that puts the nozzle over the camera')
+    parser.add_argument('-t', '--tools', type=int, nargs='+', help='tools to calibrate, all by default, the first is the reference')
+    parser.add_argument('-a', '--algorithms', nargs='+', default=['gaussian_blur', 'grayscale', 'hough_circle_finder'])
+    parser.add_argument('--tolerance', type=float, default=0.5, help='pixels from the image centre to accept')
+    parser.add_argument('--max-iterations', type=int, default=10)
+    parser.add_argument('--settle-time', type=float, default=0.1, help='seconds after arrival before frames are used')
+    parser.add_argument('--feedrate', type=int, default=6000, help='travel feedrate in mm/min')
+    parser.add_argument('--telemetry-rate', type=float, default=20, help='status polls per second, 0 to confirm moves by polling instead')
+    parser.add_argument('--write-offsets', action='store_true', help='write the measured offsets with G10')
+    parser.add_argument('--no-park', action='store_true', help='leave the last tool mounted')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    api = DuetWebAPI(args.printer)
+    telemetry = TelemetryPoller(api, args.telemetry_rate) if args.telemetry_rate > 0 else None
+    vision = AlgorithmThread(open_source(args.source), telemetry=telemetry)
+    if not vision.load_algorithms(args.algorithms):
+        return 1
+
+    if telemetry is not None:
+        telemetry.start()
+    vision.start()
+    try:
+        engine = CalibrationEngine(
+            api, vision, {'X': args.camera_x, 'Y': args.camera_y}, tolerance_px=args.tolerance,
+            max_iterations=args.max_iterations, settle_time=args.settle_time, feedrate=args.feedrate,
+            write_offsets=args.write_offsets, telemetry=telemetry
+        )
+        results = engine.run(args.tools, park=not args.no_park)
+    finally:
+        vision.close()
+        if telemetry is not None:
+            telemetry.close()
+        api.close()
+
+    for calibration in results:
+        status = 'ok' if calibration.converged else 'not converged'
+        print(
+            f'T{calibration.tool}: X{calibration.offsets["X"]:.3f} Y{calibration.offsets["Y"]:.3f}  '
+            f'{calibration.error_px:.2f} px after {calibration.iterations} jogs, {calibration.wall_time:.1f}s ({status})',
+            file=sys.stderr
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump([calibration.to_dict() for calibration in results], f, indent=2)
+    return 0 if all(calibration.converged for calibration in results) else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
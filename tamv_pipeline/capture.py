@@ -0,0 +1,126 @@
+from tamv_pipeline.recording import EXTENSION, RecordingCapture
+import time
+import cv2
+import os
+
+
+def decode_fourcc(value):
+    value = int(value)
+    return ''.join(chr((value >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00')
+
+
+class VideoCapture:
+    # Frames are handed over as decoded, the algorithm chain converts once to what it needs
+    colorspace = 'BGR'
+    paced = False
+
+    def __init__(self, video_source=0, width=None, height=None, fourcc=None, fps=None, buffer_size=None,
+                 latest_only=False, max_drain=8):
+        self.stream = cv2.VideoCapture(video_source)
+        if not self.stream.isOpened():
+            raise ValueError('Unable to open video source ', video_source)
+
+        # V4L2 picks the resolutions on offer from the pixel format, so FOURCC goes first
+        if fourcc is not None:
+            self.stream.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if width is not None:
+            self.stream.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height is not None:
+            self.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps is not None:
+            self.stream.set(cv2.CAP_PROP_FPS, fps)
+        if buffer_size is not None:
+            self.stream.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+
+        # Drivers silently fall back to what they support, keep what was actually negotiated
+        self.width = self.stream.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.fps = self.stream.get(cv2.CAP_PROP_FPS)
+        self.fourcc = decode_fourcc(self.stream.get(cv2.CAP_PROP_FOURCC))
+        self.buffer_size = self.stream.get(cv2.CAP_PROP_BUFFERSIZE)
+
+        self.latest_only = latest_only
+        self.max_drain = max_drain
+        self.drained = 0
+        # Monotonic time the last returned frame came off the driver
+        self.timestamp = None
+
+    def grab_latest(self):
+        # Buffered frames come back from grab() at once, a fresh one makes it wait for the sensor.
+        # Grabbing without decoding until a grab blocks skips straight to the newest frame.
+        stale_after = 0.5 / self.fps if self.fps and self.fps > 0 else 0.005
+        grabs = 0
+        while grabs <= self.max_drain:
+            grab_start = time.monotonic()
+            if not self.stream.grab():
+                return False
+            grabs += 1
+            if time.monotonic() - grab_start >= stale_after:
+                break
+
+        # Every grab before the last was a stale frame, thrown away without being decoded
+        self.drained += grabs - 1
+        return True
+
+    def get_frame(self):
+        if self.stream.isOpened():
+            success = self.grab_latest() if self.latest_only else self.stream.grab()
+            if not success:
+                return None
+
+            # Latency is measured from when the frame came off the driver, decoding counts against it
+            self.timestamp = time.monotonic()
+            success, frame = self.stream.retrieve()
+            if success:
+                return frame
+            else:
+                return None
+        else:
+            return None
+
+    def __del__(self):
+        if self.stream.isOpened():
+            self.stream.release()
+
+
+class ImageFolderCapture:
+    extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+    colorspace = 'BGR'
+    paced = False
+
+    def __init__(self, directory, fps=30):
+        self.files = sorted(
+            os.path.join(directory, f) for f in os.listdir(directory)
+            if f.lower().endswith(self.extensions)
+        )
+        if not self.files:
+            raise ValueError('No images found in ', directory)
+
+        self.index = 0
+        self.fps = fps
+
+        first = cv2.imread(self.files[0])
+        self.height, self.width = first.shape[:2]
+
+    def get_frame(self):
+        while self.index < len(self.files):
+            frame = cv2.imread(self.files[self.index])
+            self.index += 1
+            if frame is not None:
+                return frame
+        return None
+
+
+def open_source(source, **capture_options):
+    if isinstance(source, int) or source.isdigit():
+        return VideoCapture(int(source), **capture_options)
+    elif source.endswith(EXTENSION):
+        return RecordingCapture(source, **capture_options)
+    elif os.path.isdir(source):
+        return ImageFolderCapture(source)
+    else:
+        return VideoCapture(source)
+
+
+def is_live_source(source):
+    return isinstance(source, int) or source.isdigit()
@@ -0,0 +1,93 @@
+import cv2
+
+
+CONVERSIONS = {
+    ('BGR', 'RGB'): cv2.COLOR_BGR2RGB,
+    ('RGB', 'BGR'): cv2.COLOR_RGB2BGR,
+    ('BGR', 'GRAY'): cv2.COLOR_BGR2GRAY,
+    ('RGB', 'GRAY'): cv2.COLOR_RGB2GRAY,
+    ('GRAY', 'BGR'): cv2.COLOR_GRAY2BGR,
+    ('GRAY', 'RGB'): cv2.COLOR_GRAY2RGB,
+}
+
+
+def convert(frame, source, target):
+    if source == target:
+        return frame
+    return cv2.cvtColor(frame, CONVERSIONS[(source, target)])
+
+
+class FrameInfo:
+    __slots__ = ('colorspace', 'dtype', 'keypoints', 'radii', 'search', 'raw_keypoints', 'consensus')
+
+    def __init__(self, colorspace, dtype='uint8', keypoints=None, radii=None, search=None, raw_keypoints=None, consensus=None):
+        self.colorspace = colorspace
+        self.dtype = dtype
+        self.keypoints = keypoints
+        self.radii = radii
+        self.search = search
+        self.raw_keypoints = raw_keypoints
+        self.consensus = consensus
+
+    def replace(self, **changes):
+        # Stages never modify the info they are given, cached outputs may still hold it
+        info = FrameInfo.__new__(FrameInfo)
+        for name in FrameInfo.__slots__:
+            setattr(info, name, changes.pop(name) if name in changes else getattr(self, name))
+        if changes:
+            raise TypeError(f'Unknown frame info fields: {", ".join(changes)}')
+        return info
+
+
+class Step:
+    __slots__ = ('name', 'algorithm', 'source', 'colorspace')
+
+    def __init__(self, name, algorithm, source, colorspace):
+        self.name = name
+        self.algorithm = algorithm
+        # Colorspace the frame arrives in and the one the algorithm expects, converted in between
+        self.source = source
+        self.colorspace = colorspace
+
+    def converts(self):
+        return self.source != self.colorspace
+
+    def convert(self, frame, info):
+        if self.source == self.colorspace:
+            return frame, info
+        return convert(frame, self.source, self.colorspace), info.replace(colorspace=self.colorspace)
+
+    def run(self, frame, info):
+        frame, info = self.convert(frame, info)
+        if self.algorithm is None:
+            return frame, info
+        return self.algorithm.process(frame, info)
+
+
+def compile_chain(algorithm_names, algorithms, colorspace='BGR', dtype='uint8', elide_noops=True):
+    steps = []
+    # The frame stays in its physical colorspace until a stage needs the logical one, so
+    # back to back conversions collapse into a single cvtColor
+    physical = logical = colorspace
+    conversion_name = None
+    for name, algorithm in zip(algorithm_names, algorithms):
+        inputs = algorithm.input_colorspaces
+        if inputs is not None and logical not in inputs:
+            raise ValueError(f'{name} takes {" or ".join(inputs)} frames but would be given {logical}')
+        if dtype not in algorithm.dtypes:
+            raise ValueError(f'{name} takes {" or ".join(algorithm.dtypes)} frames but would be given {dtype}')
+
+        if algorithm.conversion_only:
+            logical = algorithm.output_colorspace or logical
+            conversion_name = name
+            continue
+        if elide_noops and algorithm.is_noop():
+            continue
+
+        steps.append(Step(name, algorithm, physical, logical))
+        physical = logical = algorithm.output_colorspace or logical
+
+    if physical != logical:
+        steps.append(Step(conversion_name, None, physical, logical))
+
+    return steps, logical
@@ -0,0 +1,291 @@
+from tamv_pipeline.pipeline import AlgorithmChain, AlgorithmThread, keypoints_to_list
+from tamv_pipeline.capture import open_source, is_live_source
+from tamv_pipeline.recording import EXTENSION as RECORDING_EXTENSION, FrameRecorder
+from tamv_pipeline.scheduler import AdaptiveScheduler
+from tamv_pipeline.stats import PipelineStats
+import threading
+import argparse
+import json
+import time
+import csv
+import sys
+
+
+DEFAULT_CHAIN = ['gaussian_blur', 'grayscale', 'hough_circle_finder']
+
+
+class KeypointWriter:
+    def __init__(self, path, output_format=None):
+        if output_format is None:
+            output_format = 'csv' if path.lower().endswith('.csv') else 'json'
+        self.output_format = output_format
+
+        self.file = sys.stdout if path == '-' else open(path, 'w', newline='')
+        self.count = 0
+
+        if self.output_format == 'csv':
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['frame', 'timestamp', 'index', 'x', 'y', 'search', 'converged', 'latency'])
+        else:
+            self.file.write('[\n')
+
+    def write(self, frame_index, timestamp, keypoints, search=None, consensus=None, latency=None):
+        keypoints = keypoints_to_list(keypoints)
+        if self.output_format == 'csv':
+            # Empty unless the chain ends in a consensus stage
+            converged = '' if consensus is None else int(consensus['converged'])
+            # Seconds from capture until the keypoints were ready
+            latency = '' if latency is None else f'{latency:.6f}'
+            if not keypoints:
+                self.writer.writerow([frame_index, f'{timestamp:.6f}', '', '', '', search or '', converged, latency])
+            for i, (x, y) in enumerate(keypoints):
+                self.writer.writerow([frame_index, f'{timestamp:.6f}', i, x, y, search or '', converged, latency])
+        else:
+            entry = {
+                'frame': frame_index, 'timestamp': timestamp, 'latency': latency, 'keypoints': keypoints,
+                'search': search, 'consensus': consensus
+            }
+            self.file.write((',\n' if self.count else '') + json.dumps(entry))
+        self.count += 1
+
+    def close(self):
+        if self.output_format == 'json':
+            self.file.write('\n]\n')
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def run_recorded(source, chain, writer, stats, fast=False, max_frames=None, recorder=None):
+    # Files and image folders are processed frame by frame so nothing is dropped
+    frame_interval = 0 if fast or source.paced or not source.fps else 1 / source.fps
+
+    start = time.monotonic()
+    next_frame = start
+    frames = 0
+    while max_frames is None or frames < max_frames:
+        capture_start = time.perf_counter()
+        frame = source.get_frame()
+        if frame is None:
+            break
+        stats.record('capture', time.perf_counter() - capture_start)
+        captured = getattr(source, 'timestamp', None) or time.monotonic()
+        if recorder is not None:
+            recorder.write(frame, frames + 1, time.monotonic(), getattr(source, 'machine', None))
+
+        _, info = chain.process(frame, stats)
+        latency = time.monotonic() - captured
+        stats.record('latency', latency)
+        frames += 1
+        # Numbered from 1 like live sequences and the recording
+        writer.write(frames, time.monotonic() - start, info.keypoints, info.search, info.consensus, latency)
+
+        if frame_interval:
+            next_frame += frame_interval
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    if recorder is not None:
+        recorder.close()
+    return frames, time.monotonic() - start
+
+
+def open_recorder(recorder, source, timeout=5.0):
+    # Sized from a first frame and opened on this thread, so a bad path or a full disk fails the run
+    # here instead of killing the capture thread
+    deadline = time.monotonic() + timeout
+    frame = source.get_frame()
+    while frame is None:
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f'No frame from the camera within {timeout}s to start the recording')
+        time.sleep(0.01)
+        frame = source.get_frame()
+    recorder.open(frame.shape, frame.dtype)
+
+
+def run_live(source, chain, writer, stats, max_frames=None, duration=None, recorder=None, scheduler=None, serve=None,
+             join_timeout=5.0):
+    if recorder is not None:
+        open_recorder(recorder, source)
+    algorithm_thread = AlgorithmThread(source, stats=stats, recorder=recorder, scheduler=scheduler)
+    algorithm_thread.chain = chain
+    algorithm_thread.start()
+
+    server = None
+    if serve is not None:
+        from tamv_pipeline.streaming import start_stream_server
+        server = start_stream_server({'camera': algorithm_thread}, port=serve)
+        print(f'Streaming on {server.url()}', file=sys.stderr)
+
+    start = time.monotonic()
+    frames = 0
+    sequence = 0
+    try:
+        while max_frames is None or frames < max_frames:
+            if duration is not None and time.monotonic() - start >= duration:
+                break
+
+            result = algorithm_thread.wait_for_result(sequence, timeout=1)
+            if result is None:
+                if not algorithm_thread.is_alive():
+                    break
+                continue
+
+            sequence = result.sequence
+            writer.write(
+                result.sequence, result.timestamp - start, result.keypoints, result.search, result.consensus, result.latency
+            )
+            frames += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.close()
+        algorithm_thread.close()
+        # The capture thread owns the recording, it is only flushed and truncated once that thread has finished
+        capture_thread = algorithm_thread.capture_thread
+        capture_thread.join(join_timeout)
+        if capture_thread.is_alive():
+            print('Capture did not stop, the recording may be incomplete', file=sys.stderr)
+
+    if capture_thread.error is not None:
+        raise RuntimeError(f'Capture failed: {capture_thread.error}') from capture_thread.error
+    return frames, time.monotonic() - start
+
+
+def run_multiprocess(source, algorithm_names, writer, stats, live=False, max_frames=None):
+    # Imported here so the default path never pays for multiprocessing start-up
+    from tamv_pipeline.multiprocess import MultiprocessPipeline
+
+    frame = source.get_frame()
+    if frame is None:
+        return 0, 0.0
+
+    pipeline = MultiprocessPipeline(algorithm_names, frame.shape, frame.dtype, colorspace=source.colorspace)
+    pipeline.start()
+    start = time.monotonic()
+
+    def feed(frame):
+        sequence = 0
+        try:
+            while frame is not None and (max_frames is None or sequence < max_frames):
+                sequence += 1
+                # Live cameras drop frames when every slot is busy, recordings wait for a slot
+                pipeline.submit(frame, sequence, time.monotonic(), block=not live)
+                frame = source.get_frame()
+        finally:
+            pipeline.finish()
+
+    feeder = threading.Thread(target=feed, args=(frame,), daemon=True)
+    feeder.start()
+
+    frames = 0
+    try:
+        while True:
+            result = pipeline.get_result(stats=stats)
+            if result is None:
+                break
+            writer.write(
+                result.sequence, result.timestamp - start, result.keypoints, result.search, result.consensus, result.latency
+            )
+            frames += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.close()
+
+    return frames, time.monotonic() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the TAMV algorithm chain without a display')
+    parser.add_argument('source', help='camera index, video file, directory of images or .tamvrec recording')
+    parser.add_argument('-a', '--algorithms', nargs='+', default=DEFAULT_CHAIN, help='algorithm chain, in order')
+    parser.add_argument('-o', '--output', default='-', help='keypoint output file (.json or .csv), - for stdout')
+    parser.add_argument('--format', choices=['json', 'csv'], help='override the output format')
+    parser.add_argument('--fast', action='store_true', help='ignore the source frame rate and run as fast as possible')
+    parser.add_argument('--record', help='also record the raw frames to this .tamvrec file')
+    parser.add_argument('--record-capacity', type=int, help='maximum frames to record, by default as many as fit --record-max-mb')
+    parser.add_argument('--record-max-mb', type=int, default=2048, help='disk budget for the recording in MiB')
+    parser.add_argument('--fps', type=float, help='playback rate for image folders')
+    parser.add_argument('--frames', type=int, help='stop after this many frames')
+    parser.add_argument('--duration', type=float, help='stop live sources after this many seconds')
+    parser.add_argument('--stats', help='write per-stage timing statistics as JSON, - for stderr')
+    parser.add_argument('--processes', action='store_true',
+                        help='run each stage in its own worker process, not with --record, --adaptive, --serve or --fast')
+    parser.add_argument('--width', type=int, help='requested camera frame width')
+    parser.add_argument('--height', type=int, help='requested camera frame height')
+    parser.add_argument('--fourcc', choices=['MJPG', 'YUYV'], help='requested camera pixel format')
+    parser.add_argument('--camera-fps', type=float, help='requested camera frame rate')
+    parser.add_argument('--buffer-size', type=int, help='camera driver buffer depth in frames')
+    parser.add_argument('--latest-only', action='store_true', help='drop frames buffered by the driver, decode only the newest')
+    parser.add_argument('--adaptive', action='store_true', help='skip expensive stages on live sources while latency or a static scene allows')
+    parser.add_argument('--target-latency', type=float, default=50, help='adaptive latency target in milliseconds')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='serve live processed frames as MJPEG over HTTP on this port')
+    args = parser.parse_args(argv)
+    if args.processes:
+        # The worker processes get frames straight from the source, none of these hook into that path
+        ignored = [
+            option for option, used in (
+                ('--record', args.record is not None), ('--adaptive', args.adaptive),
+                ('--serve', args.serve is not None), ('--fast', args.fast)
+            ) if used
+        ]
+        if ignored:
+            parser.error(f'--processes cannot be combined with {", ".join(ignored)}')
+
+    capture_options = {}
+    if is_live_source(args.source):
+        capture_options = {
+            'width': args.width, 'height': args.height, 'fourcc': args.fourcc, 'fps': args.camera_fps,
+            'buffer_size': args.buffer_size, 'latest_only': args.latest_only
+        }
+    elif args.source.endswith(RECORDING_EXTENSION):
+        capture_options = {'fast': args.fast}
+    source = open_source(args.source, **capture_options)
+    if is_live_source(args.source):
+        print(
+            f'Camera {source.width:.0f}x{source.height:.0f} {source.fourcc or "?"} at {source.fps:.1f} fps, '
+            f'buffer {source.buffer_size:.0f}', file=sys.stderr
+        )
+    if args.fps:
+        source.fps = args.fps
+    chain = AlgorithmChain(args.algorithms, source.colorspace)
+    writer = KeypointWriter(args.output, args.format)
+    stats = PipelineStats(window=10000)
+    recorder = None
+    if args.record:
+        recorder = FrameRecorder(args.record, args.record_capacity, source.colorspace, max_bytes=args.record_max_mb * 1024 ** 2)
+
+    try:
+        if args.processes:
+            frames, elapsed = run_multiprocess(source, args.algorithms, writer, stats, is_live_source(args.source), args.frames)
+        elif is_live_source(args.source):
+            scheduler = AdaptiveScheduler(args.target_latency / 1000) if args.adaptive else None
+            frames, elapsed = run_live(
+                source, chain, writer, stats, args.frames, args.duration, recorder, scheduler, args.serve
+            )
+        else:
+            frames, elapsed = run_recorded(source, chain, writer, stats, args.fast, args.frames, recorder)
+    finally:
+        writer.close()
+        # The capture thread owns a live recording and closes it once it stops writing
+        if recorder is not None:
+            if recorder.error is not None:
+                print(f'Recording stopped early ({recorder.error}), {recorder.skipped} frames were not recorded', file=sys.stderr)
+            elif recorder.skipped:
+                print(f'Recording full, {recorder.skipped} frames were not recorded', file=sys.stderr)
+
+    if args.stats == '-':
+        print(stats.to_json(), file=sys.stderr)
+    elif args.stats:
+        with open(args.stats, 'w') as f:
+            f.write(stats.to_json())
+
+    fps = frames / elapsed if elapsed > 0 else 0
+    print(f'{frames} frames in {elapsed:.2f}s ({fps:.1f} fps)', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+from tamv_pipeline.pipeline import AlgorithmChain, CaptureThread, FrameQueue, FrameResult, ResultSlot, StageResets
+from tamv_pipeline.capture import open_source
+from tamv_pipeline.stats import PipelineStats
+import concurrent.futures
+import threading
+import argparse
+import time
+import sys
+
+
+class CameraPipeline:
+    def __init__(self, name, stream, algorithm_names, executor, queue_size=2, stats=None, telemetry=None, recorder=None):
+        self.name = name
+        self.stream = stream
+        self.executor = executor
+
+        self.stages = {}
+        self.chain = AlgorithmChain(algorithm_names, stream.colorspace, self.stages)
+        self.stats = stats if stats is not None else PipelineStats()
+        self.frame_queue = FrameQueue(queue_size)
+        self.capture_thread = CaptureThread(
+            stream, self.frame_queue, self.stats, telemetry, recorder=recorder, on_frame=self.schedule
+        )
+
+        self.resets = StageResets()
+        self.results = ResultSlot()
+        # At most one frame per camera is in the pool at a time, stages keep tracking state between frames
+        self.__scheduled = False
+        self.__schedule_lock = threading.Lock()
+        self.__closed = False
+        self.__last_failure = None
+
+    def start(self):
+        self.capture_thread.start()
+
+    def schedule(self):
+        with self.__schedule_lock:
+            if self.__scheduled or self.__closed:
+                return
+            self.__scheduled = True
+        self.executor.submit(self.process_next).add_done_callback(self.report_failure)
+
+    def report_failure(self, future):
+        # Nothing else would ever look at the future, a stage raising would just stop this camera's results
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        self.stats.record_error('pipeline', error)
+        # A stage that fails on every frame is reported once, the stats keep counting
+        if repr(error) != self.__last_failure:
+            self.__last_failure = repr(error)
+            print(f'{self.name}: frame processing failed: {error!r}', file=sys.stderr)
+
+    def process_next(self):
+        try:
+            captured = self.frame_queue.get(timeout=0)
+            # Only one frame is ever in flight, so stages are never reset under a running chain
+            self.resets.apply(self.chain)
+            if captured is not None and not self.resets.stale(captured):
+                frame, info = self.chain.process(captured.image, self.stats)
+                latency = time.monotonic() - captured.timestamp
+                self.stats.record('latency', latency)
+                self.publish(FrameResult.from_info(captured, frame, info, self.chain.colorspace, latency=latency))
+        finally:
+            with self.__schedule_lock:
+                self.__scheduled = False
+            # A frame that arrived while this one was processed found the pipeline busy
+            if self.frame_queue.pending():
+                self.schedule()
+
+    @property
+    def result(self):
+        return self.results.result
+
+    def publish(self, result):
+        self.results.publish(result)
+
+    def wait_for_result(self, after_sequence=0, timeout=None):
+        return self.results.wait(after_sequence, timeout)
+
+    def reset_stages(self):
+        # Between tools or jogs, detections of the old position must not leak into the new estimate
+        self.resets.request()
+
+    def update_settings(self, algorithm_name, **values):
+        return self.stages[algorithm_name].update(**values)
+
+    def close(self):
+        with self.__schedule_lock:
+            self.__closed = True
+        self.capture_thread.close()
+        self.frame_queue.close()
+        self.results.close()
+
+
+class PipelineManager:
+    def __init__(self, workers=None):
+        # OpenCV drops the GIL inside its kernels, so camera pipelines run in parallel on plain threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pipeline')
+        self.pipelines = {}
+
+    def add(self, name, stream, algorithm_names, **options):
+        if name in self.pipelines:
+            raise ValueError('A pipeline with this name already exists ', name)
+        pipeline = CameraPipeline(name, stream, algorithm_names, self.executor, **options)
+        self.pipelines[name] = pipeline
+        return pipeline
+
+    def start(self):
+        for pipeline in self.pipelines.values():
+            pipeline.start()
+
+    def results(self):
+        return {name: pipeline.result for name, pipeline in self.pipelines.items()}
+
+    def snapshot(self):
+        return {name: pipeline.stats.snapshot() for name, pipeline in self.pipelines.items()}
+
+    def close(self):
+        for pipeline in self.pipelines.values():
+            pipeline.close()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run one TAMV algorithm chain per camera in a single process')
+    parser.add_argument('sources', nargs='+', help='camera indexes, video files or recordings, one pipeline each')
+    parser.add_argument('-a', '--algorithms', nargs='+', default=['gaussian_blur', 'grayscale', 'hough_circle_finder'])
+    parser.add_argument('--workers', type=int, help='thread pool size, defaults to one per CPU')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run for')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='serve every camera as MJPEG over HTTP on this port')
+    args = parser.parse_args(argv)
+
+    with PipelineManager(args.workers) as manager:
+        for source in args.sources:
+            manager.add(source, open_source(source), args.algorithms)
+        manager.start()
+
+        server = None
+        if args.serve is not None:
+            from tamv_pipeline.streaming import start_stream_server
+            server = start_stream_server(manager.pipelines, port=args.serve)
+            print(f'Streaming on {server.url()}', file=sys.stderr)
+        try:
+            time.sleep(args.duration)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if server is not None:
+                server.close()
+
+        for name, pipeline in manager.pipelines.items():
+            print(f'{name}:', file=sys.stderr)
+            print(pipeline.stats.format_table(), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
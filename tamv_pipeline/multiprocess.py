@@ -0,0 +1,201 @@
+from multiprocessing import shared_memory
+from tamv_pipeline.compiler import FrameInfo, Step, compile_chain
+from tamv_pipeline.pipeline import AlgorithmLoader, FrameResult
+import multiprocessing
+import numpy as np
+import queue
+import time
+import cv2
+
+
+class SharedFrameRing:
+    def __init__(self, memory, slots, slot_bytes, free, frames, owner):
+        self.memory = memory
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        # Slot indices ready to be written, and descriptors of written slots ready to be read
+        self.free = free
+        self.frames = frames
+        self.owner = owner
+
+    @classmethod
+    def create(cls, slots, slot_bytes):
+        memory = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        free = multiprocessing.Queue()
+        for slot in range(slots):
+            free.put(slot)
+        return cls(memory, slots, slot_bytes, free, multiprocessing.Queue(), True)
+
+    @classmethod
+    def attach(cls, name, slots, slot_bytes, free, frames):
+        memory = shared_memory.SharedMemory(name=name)
+        return cls(memory, slots, slot_bytes, free, frames, False)
+
+    def spec(self):
+        return self.memory.name, self.slots, self.slot_bytes, self.free, self.frames
+
+    def view(self, descriptor):
+        return np.ndarray(
+            descriptor['shape'], np.dtype(descriptor['dtype']),
+            buffer=self.memory.buf, offset=descriptor['slot'] * self.slot_bytes
+        )
+
+    def write(self, slot, frame, descriptor):
+        frame = np.ascontiguousarray(frame)
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f'Frame of {frame.nbytes} bytes does not fit a {self.slot_bytes} byte slot')
+
+        descriptor = dict(descriptor, slot=slot, shape=frame.shape, dtype=frame.dtype.str)
+        np.copyto(self.view(descriptor), frame)
+        return descriptor
+
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def run_stage(step, input_ring, output_ring, descriptor):
+    # Views into shared memory stay local so they are released before the rings close
+    frame = input_ring.view(descriptor)
+    stage_start = time.perf_counter()
+    error = None
+    try:
+        frame, info = step.run(frame, descriptor['info'])
+    except cv2.error as exception:
+        info = descriptor['info']
+        error = str(exception)
+    elapsed = time.perf_counter() - stage_start
+
+    output = output_ring.write(output_ring.free.get(), frame, descriptor)
+    input_ring.free.put(descriptor['slot'])
+
+    output['info'] = info
+    output['timings'] = descriptor['timings'] + [(step.name, elapsed, error)]
+    return output
+
+
+def stage_worker(step_spec, input_spec, output_spec, control):
+    name, settings, source, colorspace = step_spec
+    # Each worker builds its own instance from the snapshot the parent compiled against
+    step = Step(name, AlgorithmLoader.create(name, **settings) if settings is not None else None, source, colorspace)
+    input_ring = SharedFrameRing.attach(*input_spec)
+    output_ring = SharedFrameRing.attach(*output_spec)
+
+    try:
+        while True:
+            descriptor = input_ring.frames.get()
+            if descriptor is None:
+                output_ring.frames.put(None)
+                break
+
+            while not control.empty():
+                step.algorithm.update(**control.get())
+
+            output_ring.frames.put(run_stage(step, input_ring, output_ring, descriptor))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        input_ring.close()
+        output_ring.close()
+
+
+class MultiprocessPipeline:
+    def __init__(self, algorithm_names, frame_shape, dtype=np.uint8, slots=4, colorspace='BGR'):
+        self.algorithm_names = list(algorithm_names)
+        self.colorspace = colorspace
+        self.dtype = np.dtype(dtype)
+
+        # Settings only reach the workers later, so no-op stages are kept rather than elided
+        algorithms = [AlgorithmLoader.create(name) for name in self.algorithm_names]
+        self.steps, self.output_colorspace = compile_chain(
+            self.algorithm_names, algorithms, colorspace, self.dtype.name, elide_noops=False
+        )
+        if not self.steps:
+            raise ValueError('A multiprocess pipeline needs at least one stage')
+
+        slot_bytes = int(np.prod(frame_shape)) * self.dtype.itemsize
+
+        # Ring i feeds step i, the last ring holds finished frames
+        self.rings = [SharedFrameRing.create(slots, slot_bytes) for _ in range(len(self.steps) + 1)]
+        self.controls = [multiprocessing.Queue() for _ in self.steps]
+        self.workers = [
+            multiprocessing.Process(
+                target=stage_worker,
+                args=(
+                    (
+                        step.name, dict(step.algorithm.snapshot) if step.algorithm is not None else None,
+                        step.source, step.colorspace
+                    ),
+                    self.rings[i].spec(), self.rings[i + 1].spec(), self.controls[i]
+                ),
+                daemon=True
+            )
+            for i, step in enumerate(self.steps)
+        ]
+        self.dropped = 0
+        self.__finished = False
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, frame, sequence, timestamp, block=False, timeout=None):
+        ring = self.rings[0]
+        try:
+            slot = ring.free.get(block, timeout)
+        except queue.Empty:
+            # Every slot is still in flight, drop rather than stall the capture side
+            self.dropped += 1
+            return False
+
+        ring.frames.put(ring.write(slot, frame, {
+            'sequence': sequence, 'timestamp': timestamp, 'info': FrameInfo(self.colorspace, self.dtype.name), 'timings': []
+        }))
+        return True
+
+    def finish(self):
+        self.rings[0].frames.put(None)
+
+    def get_result(self, timeout=None, stats=None):
+        if self.__finished:
+            return None
+
+        ring = self.rings[-1]
+        descriptor = ring.frames.get(timeout=timeout)
+        if descriptor is None:
+            self.__finished = True
+            return None
+
+        frame = ring.view(descriptor).copy()
+        ring.free.put(descriptor['slot'])
+
+        if stats is not None:
+            for name, elapsed, error in descriptor['timings']:
+                stats.record(name, elapsed)
+                if error is not None:
+                    stats.record_error(name, error)
+
+        info = descriptor['info']
+        latency = time.monotonic() - descriptor['timestamp']
+        if stats is not None:
+            stats.record('latency', latency)
+        return FrameResult(
+            descriptor['sequence'], descriptor['timestamp'], frame, info.keypoints, colorspace=info.colorspace,
+            latency=latency, search=info.search, consensus=info.consensus, radii=info.radii
+        )
+
+    def update_settings(self, algorithm_name, values):
+        for step, control in zip(self.steps, self.controls):
+            if step.name == algorithm_name and step.algorithm is not None:
+                control.put(dict(values))
+
+    def close(self, timeout=5):
+        if not self.__finished:
+            self.finish()
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        for ring in self.rings:
+            ring.close()
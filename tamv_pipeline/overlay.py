@@ -0,0 +1,110 @@
+import numpy as np
+import cv2
+
+
+class Overlay:
+    def __init__(self):
+        self.overlays = []
+
+        # Static overlays are rasterised once per frame shape and reused until they change
+        self.__dirty = True
+        self.__shape = None
+        self.__indices = None
+        self.__premultiplied = None
+        self.__inverse_alpha = None
+
+    def clear(self):
+        self.overlays = []
+        self.__dirty = True
+
+    def add_circle(self, position, radius, color=(255, 0, 0), stroke=1, opacity=1.0):
+        self.overlays.append(['circle', position, radius, color, stroke, opacity])
+        self.__dirty = True
+
+    def add_crosshair(self, position, radius, color=(255, 0, 0), stroke=1, style=0, opacity=1.0):
+        self.overlays.append([f'crosshair{style}', position, radius, color, stroke, opacity])
+        self.__dirty = True
+
+    def add_grid(self, spacing, color=(80, 80, 80), stroke=1, opacity=0.5):
+        self.overlays.append(['grid', spacing, color, stroke, opacity])
+        self.__dirty = True
+
+    def add_scale_bar(self, position, length, color=(255, 255, 255), stroke=2, label=None, opacity=1.0):
+        self.overlays.append(['scale_bar', position, length, color, stroke, label, opacity])
+        self.__dirty = True
+
+    @staticmethod
+    def draw_primitive(image, overlay, color):
+        height, width = image.shape[:2]
+        if overlay[0] == 'circle':
+            _, position, radius, _, stroke, _ = overlay
+            cv2.circle(image, position, radius, color, stroke)
+
+        elif overlay[0] == 'crosshair0':
+            _, (x, y), radius, _, stroke, _ = overlay
+            cv2.line(image, (x - radius, y), (x + radius, y), color, stroke)
+            cv2.line(image, (x, y - radius), (x, y + radius), color, stroke)
+
+        elif overlay[0] == 'grid':
+            _, spacing, _, stroke, _ = overlay
+            for x in range(spacing, width, spacing):
+                cv2.line(image, (x, 0), (x, height), color, stroke)
+            for y in range(spacing, height, spacing):
+                cv2.line(image, (0, y), (width, y), color, stroke)
+
+        elif overlay[0] == 'scale_bar':
+            _, (x, y), length, _, stroke, label, _ = overlay
+            cv2.line(image, (x, y), (x + length, y), color, stroke)
+            if label:
+                cv2.putText(image, label, (x, y - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1, cv2.LINE_AA)
+
+    def rasterize(self, shape):
+        height, width = shape[:2]
+        layer = np.zeros((height, width, 3), dtype=np.uint8)
+        alpha = np.zeros((height, width), dtype=np.uint8)
+        coverage = np.zeros((height, width), dtype=np.uint8)
+
+        for overlay in self.overlays:
+            color = overlay[2] if overlay[0] == 'grid' else overlay[3]
+            opacity = overlay[-1]
+            self.draw_primitive(layer, overlay, color)
+
+            # Coverage is drawn separately so each primitive keeps its own opacity
+            coverage[:] = 0
+            self.draw_primitive(coverage, overlay, 255)
+            np.maximum(alpha, (coverage * opacity).astype(np.uint8), out=alpha)
+
+        if len(shape) == 2:
+            layer = cv2.cvtColor(layer, cv2.COLOR_RGB2GRAY)[:, :, None]
+
+        # Only covered pixels take part in the blend, stored premultiplied for integer maths
+        self.__indices = np.flatnonzero(alpha)
+        covered_alpha = alpha.reshape(-1)[self.__indices].astype(np.uint16)[:, None]
+        self.__premultiplied = layer.reshape(-1, layer.shape[2])[self.__indices].astype(np.uint16) * covered_alpha
+        self.__inverse_alpha = 255 - covered_alpha
+        self.__shape = shape
+        self.__dirty = False
+
+    def draw(self, frame, keypoints=None, keypoint_radius=8, keypoint_color=(0, 255, 0), scale=1.0, radii=None):
+        if self.__dirty or self.__shape != frame.shape:
+            self.rasterize(frame.shape)
+
+        frame = np.ascontiguousarray(frame)
+        if self.__indices.size:
+            pixels = frame.reshape(-1, 1 if frame.ndim == 2 else frame.shape[2])
+            blended = pixels[self.__indices] * self.__inverse_alpha + self.__premultiplied
+            pixels[self.__indices] = ((blended + 127) // 255).astype(np.uint8)
+
+        # Keypoints change every frame, they are cheap enough to draw directly.
+        # Detected circles are drawn at their own radius, other keypoints get a fixed size marker
+        if keypoints:
+            color = keypoint_color if frame.ndim == 3 else int(np.mean(keypoint_color))
+            if radii is None or len(radii) != len(keypoints):
+                radii = [None] * len(keypoints)
+            for keypoint, radius in zip(keypoints, radii):
+                x, y = int(round(keypoint[0] * scale)), int(round(keypoint[1] * scale))
+                radius = keypoint_radius if radius is None else max(int(round(radius * scale)), 1)
+                cv2.circle(frame, (x, y), radius, color, 1, cv2.LINE_AA)
+                cv2.drawMarker(frame, (x, y), color, cv2.MARKER_CROSS, keypoint_radius, 1)
+
+        return frame
@@ -0,0 +1,477 @@
+from tamv_pipeline.compiler import FrameInfo, compile_chain
+from tamv_pipeline.stats import PipelineStats
+import collections
+import importlib
+import threading
+import time
+import cv2
+
+
+class AlgorithmLoader:
+    loaded_algorithms = {}
+
+    @staticmethod
+    def load_algorithm(name):
+        # Modules are cached, each holds one Stage class named after the module, gaussian_blur -> GaussianBlur
+        if name in AlgorithmLoader.loaded_algorithms:
+            return AlgorithmLoader.loaded_algorithms[name]
+        else:
+            module = importlib.import_module(f'.{name}', 'tamv_algorithms')
+            algorithm = getattr(module, ''.join(part.capitalize() for part in name.split('_')))
+            AlgorithmLoader.loaded_algorithms[name] = algorithm
+            return algorithm
+
+    @staticmethod
+    def create(name, **settings):
+        return AlgorithmLoader.load_algorithm(name)(name, **settings)
+
+
+def settings_key(algorithm):
+    return algorithm.snapshot.version
+
+
+def same_step(a, b):
+    return a.name == b.name and a.algorithm is b.algorithm and a.source == b.source and a.colorspace == b.colorspace
+
+
+class AlgorithmChain:
+    def __init__(self, algorithm_names=(), colorspace='BGR', stages=None):
+        self.algorithm_names = list(algorithm_names)
+        # Stages are looked up in, and added to, the given pool so settings survive a reorder
+        stages = stages if stages is not None else {}
+        for name in self.algorithm_names:
+            if name not in stages:
+                stages[name] = AlgorithmLoader.create(name)
+        self.stages = stages
+        self.algorithms = [stages[name] for name in self.algorithm_names]
+        self.input_colorspace = colorspace
+
+        # Invalid orderings fail here rather than as cv2 errors on every frame
+        self.steps, self.colorspace = compile_chain(self.algorithm_names, self.algorithms, colorspace)
+        self.compiled_settings = self.settings_key()
+        self.compiled_noops = self.noop_key()
+
+        # Per step (key, frame, info), the key covers the frame and all upstream settings
+        self.cache = [None] * len(self.steps)
+
+        # Output of the last run that included the expensive stages, and whether the last run skipped them
+        self.carried = None
+        self.skipped = False
+
+    def settings_key(self):
+        return tuple(settings_key(algorithm) for algorithm in self.algorithms)
+
+    def noop_key(self):
+        return tuple(algorithm.is_noop() for algorithm in self.algorithms)
+
+    def reset(self):
+        # Tracking state, consensus history and carried results all describe frames from before the reset
+        for algorithm in self.algorithms:
+            algorithm.reset()
+        self.cache = [None] * len(self.steps)
+        self.carried = None
+
+    def recompile(self):
+        current_settings = self.settings_key()
+        if current_settings == self.compiled_settings:
+            return
+        self.compiled_settings = current_settings
+
+        # Settings decide which stages are no-ops, only a change there adds or drops a step.
+        # Any other change is picked up by the per step cache keys
+        noops = self.noop_key()
+        if noops == self.compiled_noops:
+            return
+        self.compiled_noops = noops
+
+        steps, self.colorspace = compile_chain(self.algorithm_names, self.algorithms, self.input_colorspace)
+        # Outputs of the leading steps that did not change are still valid
+        cache = [None] * len(steps)
+        for i, (old, new) in enumerate(zip(self.steps, steps)):
+            if not same_step(old, new):
+                break
+            cache[i] = self.cache[i]
+        self.steps, self.cache = steps, cache
+        self.carried = None
+
+    @staticmethod
+    def run_stage(step, frame, info, stats):
+        stage_start = time.perf_counter()
+        try:
+            frame, info = step.run(frame, info)
+        except cv2.error as error:
+            if stats is not None:
+                stats.record_error(step.name, error)
+        if stats is not None:
+            stats.record(step.name, time.perf_counter() - stage_start)
+        return frame, info
+
+    def process(self, frame, stats=None, skip_expensive=False):
+        self.recompile()
+        info = FrameInfo(self.input_colorspace, frame.dtype.name)
+        chain_start = time.perf_counter()
+        skipping = False
+        for step in self.steps:
+            if skip_expensive and self.carried is not None and step.algorithm is not None and step.algorithm.expensive:
+                skipping = True
+            if skipping:
+                # Everything downstream depends on the skipped stage, only keep the frame in the right colorspace
+                frame, info = step.convert(frame, info)
+                continue
+            frame, info = self.run_stage(step, frame, info, stats)
+
+        if skipping:
+            info = self.carried.replace(colorspace=info.colorspace, dtype=info.dtype)
+        else:
+            self.carried = info
+        self.skipped = skipping
+
+        if stats is not None:
+            stats.record('chain_skipped' if skipping else 'chain', time.perf_counter() - chain_start)
+
+        return frame, info
+
+    def process_cached(self, frame, frame_id, stats=None):
+        self.recompile()
+        info = FrameInfo(self.input_colorspace, frame.dtype.name)
+        key = (frame_id,)
+        recomputed = 0
+        for i, step in enumerate(self.steps):
+            key += (settings_key(step.algorithm) if step.algorithm is not None else None,)
+            if self.cache[i] is not None and self.cache[i][0] == key:
+                _, frame, info = self.cache[i]
+                continue
+
+            frame, info = self.run_stage(step, frame, info, stats)
+            self.cache[i] = (key, frame, info)
+            recomputed += 1
+
+        return frame, info, recomputed
+
+
+class CapturedFrame:
+    def __init__(self, sequence, timestamp, image, machine=None):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.image = image
+        self.machine = machine
+
+
+class FrameQueue:
+    def __init__(self, maxsize=2):
+        self.maxsize = maxsize
+        self.dropped = 0
+
+        self.__frames = collections.deque()
+        self.__condition = threading.Condition()
+        self.__sequence = 0
+        self.__closed = False
+
+    def put(self, image, machine=None, timestamp=None):
+        with self.__condition:
+            if len(self.__frames) >= self.maxsize:
+                self.__frames.popleft()
+                self.dropped += 1
+
+            self.__sequence += 1
+            timestamp = timestamp if timestamp is not None else time.monotonic()
+            self.__frames.append(CapturedFrame(self.__sequence, timestamp, image, machine))
+            self.__condition.notify_all()
+            return self.__sequence
+
+    def get(self, timeout=None):
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__frames or self.__closed, timeout)
+            if self.__frames:
+                return self.__frames.popleft()
+            return None
+
+    def pending(self):
+        return len(self.__frames)
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    def closed(self):
+        return self.__closed
+
+
+class CaptureThread(threading.Thread):
+    def __init__(self, stream, frame_queue, stats=None, telemetry=None, retry_delay=0.01, recorder=None, on_frame=None):
+        self.stream = stream
+        self.frame_queue = frame_queue
+        self.stats = stats
+        self.telemetry = telemetry
+        self.recorder = recorder
+        self.on_frame = on_frame
+        self.retry_delay = retry_delay
+
+        self.should_exit = False
+        self.error = None
+
+        threading.Thread.__init__(self, daemon=True)
+
+    def run(self):
+        try:
+            self.capture()
+        except Exception as error:
+            self.error = error
+            raise
+        finally:
+            # Consumers waiting on the queue always learn that capture has stopped
+            self.frame_queue.close()
+            if self.recorder is not None:
+                self.recorder.close()
+
+    def capture(self):
+        while not self.should_exit:
+            capture_start = time.perf_counter()
+            frame = self.stream.get_frame()
+            if self.stats is not None:
+                if frame is None:
+                    self.stats.record_error('capture')
+                else:
+                    self.stats.record('capture', time.perf_counter() - capture_start)
+
+            if frame is None:
+                # Camera hiccup or not ready yet, back off instead of spinning
+                time.sleep(self.retry_delay)
+                continue
+            # The poller keeps the latest machine state ready, tagging costs no HTTP round-trip,
+            # replayed recordings carry the machine state they were recorded with
+            if self.telemetry is not None:
+                machine = self.telemetry.latest()
+            else:
+                machine = getattr(self.stream, 'machine', None)
+            # Sources that know when the driver delivered the frame stamp it themselves
+            timestamp = getattr(self.stream, 'timestamp', None) or time.monotonic()
+            sequence = self.frame_queue.put(frame, machine, timestamp)
+
+            if self.recorder is not None:
+                self.recorder.write(frame, sequence, timestamp, machine)
+            if self.on_frame is not None:
+                self.on_frame()
+
+    def close(self):
+        self.should_exit = True
+
+
+def keypoints_to_list(keypoints):
+    if keypoints is None:
+        return []
+    return [[float(x), float(y)] for (x, y) in keypoints]
+
+
+class FrameResult:
+    def __init__(self, sequence, timestamp, frame, keypoints, machine=None, revision=0, colorspace=None, latency=None,
+                 keypoints_timestamp=None, search=None, consensus=None, radii=None):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.frame = frame
+        self.keypoints = keypoints
+        # Circle radius per keypoint, None for locators that only find a position
+        self.radii = radii
+        self.machine = machine
+        # How the keypoints were found ('full', 'roi', 'template', ...) and the consensus stage's estimate, if any
+        self.search = search
+        self.consensus = consensus
+        self.colorspace = colorspace
+        # Seconds from capture until the keypoints were ready
+        self.latency = latency
+        # Capture time of the frame the keypoints were found in, older than timestamp when carried forward
+        self.keypoints_timestamp = keypoints_timestamp if keypoints_timestamp is not None else timestamp
+        # Bumped when the same captured frame is reprocessed with new settings
+        self.revision = revision
+
+    @classmethod
+    def from_info(cls, captured, frame, info, colorspace, **options):
+        return cls(
+            captured.sequence, captured.timestamp, frame, info.keypoints, captured.machine, colorspace=colorspace,
+            search=info.search, consensus=info.consensus, radii=info.radii, **options
+        )
+
+
+class StageResets:
+    # Requested from any thread, applied by the one running the chain so stages are never reset mid-frame
+    def __init__(self):
+        self.__requested = None
+        self.__before = 0.0
+        self.__lock = threading.Lock()
+
+    def request(self):
+        with self.__lock:
+            self.__requested = time.monotonic()
+
+    def apply(self, chain):
+        with self.__lock:
+            requested, self.__requested = self.__requested, None
+        if requested is None:
+            return False
+        chain.reset()
+        self.__before = requested
+        return True
+
+    def stale(self, captured):
+        # Captured before the reset, e.g. while the machine was still on its way
+        return captured.timestamp < self.__before
+
+
+class ResultSlot:
+    # Frame and keypoints are published together as a single reference swap
+    def __init__(self):
+        self.result = None
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+    def publish(self, result):
+        with self.__condition:
+            self.result = result
+            self.__condition.notify_all()
+
+    def wait(self, after_sequence=0, timeout=None):
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: self.__closed or (self.result is not None and self.result.sequence > after_sequence),
+                timeout
+            )
+            if self.result is not None and self.result.sequence > after_sequence:
+                return self.result
+            return None
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+
+class AlgorithmThread(threading.Thread):
+    def __init__(self, stream, queue_size=2, stats=None, telemetry=None, recorder=None, scheduler=None):
+        self.stream = stream
+        # Stage instances by name, shared by every chain this thread loads
+        self.stages = {}
+        self.chain = AlgorithmChain(colorspace=stream.colorspace, stages=self.stages)
+
+        self.temp_chain = None
+
+        self.should_exit = False
+
+        # Freeze-frame tuning holds one captured frame and only reruns stages whose settings changed
+        self.freeze_frame = False
+        self.frozen = None
+        self.freeze_poll_interval = 0.02
+        self.__wakeup = threading.Event()
+
+        self.scheduler = scheduler
+        self.__keypoints_timestamp = None
+
+        self.resets = StageResets()
+        self.results = ResultSlot()
+
+        self.stats = stats if stats is not None else PipelineStats()
+        self.frame_queue = FrameQueue(queue_size)
+        self.capture_thread = CaptureThread(stream, self.frame_queue, self.stats, telemetry, recorder=recorder)
+
+        threading.Thread.__init__(self, daemon=True)
+
+    def start(self):
+        self.capture_thread.start()
+        threading.Thread.start(self)
+
+    def run(self):
+        while not self.should_exit:
+            if self.freeze_frame and self.frozen is not None:
+                self.process_frozen()
+                continue
+            self.frozen = None
+
+            captured = self.frame_queue.get(timeout=0.5)
+            if captured is None:
+                if self.frame_queue.closed():
+                    break
+                continue
+
+            if self.temp_chain is not None:
+                self.chain, self.temp_chain = self.temp_chain, None
+
+            if self.resets.apply(self.chain):
+                self.__keypoints_timestamp = None
+            if self.resets.stale(captured):
+                continue
+
+            if self.freeze_frame:
+                self.frozen = captured
+                continue
+
+            full = True
+            if self.scheduler is not None:
+                full = self.scheduler.plan(captured.image, self.stream.colorspace, self.chain.settings_key())
+
+            frame, info = self.chain.process(captured.image, self.stats, skip_expensive=not full)
+            if not self.chain.skipped:
+                self.__keypoints_timestamp = captured.timestamp
+            latency = time.monotonic() - captured.timestamp
+            self.stats.record('latency', latency)
+            self.publish(FrameResult.from_info(
+                captured, frame, info, self.chain.colorspace, latency=latency, keypoints_timestamp=self.__keypoints_timestamp
+            ))
+
+            if self.scheduler is not None:
+                self.scheduler.record(latency, not self.chain.skipped)
+                # A static scene is sampled at the idle rate, the camera keeps running but nothing is processed
+                idle_interval = self.scheduler.frame_interval()
+                if idle_interval:
+                    self.__wakeup.wait(max(idle_interval - (time.monotonic() - captured.timestamp), 0))
+                    self.__wakeup.clear()
+
+        self.should_exit = True
+        self.results.close()
+
+    def process_frozen(self):
+        if self.temp_chain is not None:
+            self.chain, self.temp_chain = self.temp_chain, None
+
+        captured = self.frozen
+        frame, info, recomputed = self.chain.process_cached(captured.image, captured.sequence, self.stats)
+        if recomputed:
+            revision = self.result.revision + 1 if self.result is not None else 1
+            self.publish(FrameResult.from_info(captured, frame, info, self.chain.colorspace, revision=revision))
+        else:
+            self.__wakeup.wait(self.freeze_poll_interval)
+            self.__wakeup.clear()
+
+    @property
+    def result(self):
+        return self.results.result
+
+    def publish(self, result):
+        self.results.publish(result)
+
+    def freeze(self, enabled=True):
+        self.freeze_frame = enabled
+        self.__wakeup.set()
+
+    def reset_stages(self):
+        # Between tools or jogs, detections of the old position must not leak into the new estimate
+        self.resets.request()
+        self.__wakeup.set()
+
+    def wait_for_result(self, after_sequence=0, timeout=None):
+        return self.results.wait(after_sequence, timeout)
+
+    def load_algorithms(self, algorithm_names):
+        try:
+            self.temp_chain = AlgorithmChain(algorithm_names, self.stream.colorspace, self.stages)
+        except ValueError as error:
+            # Keep running the previous chain until the ordering is valid again
+            print(f'Invalid algorithm chain: {error}')
+            return False
+        return True
+
+    def close(self):
+        self.should_exit = True
+        self.__wakeup.set()
+        self.capture_thread.close()
+        self.frame_queue.close()
+        self.results.close()
@@ -0,0 +1,242 @@
+import numpy as np
+import json
+import time
+import os
+
+
+MAGIC = b'TAMVREC1'
+EXTENSION = '.tamvrec'
+
+# Magic, frame count and JSON metadata share the first page, index and frames start page aligned
+HEADER_SIZE = 4096
+ALIGNMENT = 4096
+
+# Without an explicit capacity a recording holds as many frames as fit this budget
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Disk space is reserved this much at a time as the recording grows
+CHUNK_BYTES = 64 * 1024 ** 2
+
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def index_dtype(axes):
+    return np.dtype([
+        ('timestamp', 'f8'),
+        ('sequence', 'i8'),
+        ('coords', 'f8', (len(axes),)),
+        ('tool', 'i4'),
+    ])
+
+
+class RecordingLayout:
+    def __init__(self, shape, dtype, capacity, colorspace='BGR', axes='XYZ'):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.colorspace = colorspace
+        self.axes = axes
+
+        self.index_dtype = index_dtype(axes)
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.index_offset = HEADER_SIZE
+        self.frames_offset = align(self.index_offset + capacity * self.index_dtype.itemsize)
+
+    def size(self, frames):
+        return self.frames_offset + frames * self.frame_bytes
+
+    def metadata(self):
+        return {
+            'shape': list(self.shape),
+            'dtype': self.dtype.str,
+            'capacity': self.capacity,
+            'colorspace': self.colorspace,
+            'axes': self.axes,
+        }
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        return cls(metadata['shape'], metadata['dtype'], metadata['capacity'], metadata['colorspace'], metadata['axes'])
+
+
+class FrameRecorder:
+    def __init__(self, path, capacity=None, colorspace='BGR', axes='XYZ', max_bytes=DEFAULT_MAX_BYTES, chunk_bytes=CHUNK_BYTES):
+        self.path = path
+        # Frames, or None to fit as many as max_bytes allows once the frame size is known
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.colorspace = colorspace
+        self.axes = axes
+
+        self.count = 0
+        self.skipped = 0
+        # Set when the recording had to stop early, e.g. the disk filled up
+        self.error = None
+        self.layout = None
+        self.index = None
+        self.frames = None
+        self.reserved = 0
+        self.__count = None
+
+    def open(self, shape, dtype):
+        capacity = self.capacity
+        if capacity is None:
+            frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            capacity = max(self.max_bytes // frame_bytes, 1)
+        self.layout = RecordingLayout(shape, dtype, capacity, self.colorspace, self.axes)
+        metadata = json.dumps(self.layout.metadata()).encode()
+        if len(MAGIC) + 8 + len(metadata) > HEADER_SIZE:
+            raise ValueError('Recording metadata does not fit the header')
+
+        with open(self.path, 'wb') as f:
+            f.write(MAGIC + bytes(8) + metadata)
+            f.truncate(self.layout.frames_offset)
+
+        self.__count = np.memmap(self.path, np.uint64, 'r+', offset=len(MAGIC), shape=(1,))
+        self.index = np.memmap(
+            self.path, self.layout.index_dtype, 'r+', offset=self.layout.index_offset, shape=(capacity,)
+        )
+        self.reserve()
+
+    def reserve(self):
+        # Space is reserved a chunk at a time, so appending a frame rarely extends the file
+        # but a long recording never claims the whole disk up front
+        chunk = max(self.chunk_bytes // self.layout.frame_bytes, 1)
+        reserved = min(self.reserved + chunk, self.layout.capacity)
+        start, size = self.layout.size(self.reserved), self.layout.size(reserved)
+        with open(self.path, 'r+b') as f:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), start, size - start)
+            else:
+                f.truncate(size)
+
+        if self.frames is not None:
+            self.frames.flush()
+        self.frames = np.memmap(
+            self.path, self.layout.dtype, 'r+', offset=self.layout.frames_offset, shape=(reserved,) + self.layout.shape
+        )
+        self.reserved = reserved
+
+    def write(self, frame, sequence, timestamp, machine=None):
+        if self.layout is None:
+            self.open(frame.shape, frame.dtype)
+        if self.count >= self.layout.capacity or self.error is not None:
+            self.skipped += 1
+            return False
+        if self.count >= self.reserved:
+            try:
+                self.reserve()
+            except OSError as error:
+                # Out of disk, what was recorded so far is kept and capture carries on without recording
+                self.error = error
+                self.skipped += 1
+                return False
+        if frame.shape != self.layout.shape:
+            raise ValueError(f'Frame shape {frame.shape} does not match the recording shape {self.layout.shape}')
+
+        self.frames[self.count] = frame
+        entry = self.index[self.count]
+        entry['timestamp'] = timestamp
+        entry['sequence'] = sequence
+        entry['coords'] = np.nan
+        if machine is not None:
+            # Telemetry may report fewer axes than the recording keeps, the missing ones stay NaN
+            coords = np.asarray(machine['coords'], dtype=np.float64).ravel()[:len(self.axes)]
+            entry['coords'][:len(coords)] = coords
+            entry['tool'] = machine['tool']
+        else:
+            entry['tool'] = -1
+
+        # The count is bumped last, a reader never sees a half written frame
+        self.count += 1
+        self.__count[0] = self.count
+        return True
+
+    def close(self):
+        if self.frames is None:
+            return
+
+        for array in (self.frames, self.index, self.__count):
+            array.flush()
+        self.frames = self.index = self.__count = None
+
+        # Give back the space reserved for frames that were never recorded
+        with open(self.path, 'r+b') as f:
+            f.truncate(self.layout.size(self.count))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise ValueError('Not a TAMV recording ', path)
+
+    count = int.from_bytes(header[len(MAGIC):len(MAGIC) + 8], 'little')
+    metadata = json.loads(header[len(MAGIC) + 8:].rstrip(b'\0'))
+    return count, RecordingLayout.from_metadata(metadata)
+
+
+class RecordingCapture:
+    # Replays pace themselves from the recorded timestamps
+    paced = True
+
+    def __init__(self, path, fast=False, loop=False):
+        self.count, self.layout = read_header(path)
+        if not self.count:
+            raise ValueError('Recording is empty ', path)
+
+        self.index = np.memmap(path, self.layout.index_dtype, 'r', offset=self.layout.index_offset, shape=(self.count,))
+        self.frames = np.memmap(
+            path, self.layout.dtype, 'r', offset=self.layout.frames_offset, shape=(self.count,) + self.layout.shape
+        )
+
+        self.colorspace = self.layout.colorspace
+        self.height, self.width = self.layout.shape[:2]
+        duration = self.index['timestamp'][-1] - self.index['timestamp'][0]
+        self.fps = (self.count - 1) / duration if duration > 0 else 0
+
+        self.fast = fast
+        self.loop = loop
+        self.position = 0
+
+        # Recorded details of the frame last returned, timestamp is when it was served for latency
+        self.timestamp = None
+        self.recorded_timestamp = None
+        self.sequence = None
+        self.machine = None
+
+        self.__clock_offset = None
+
+    def get_frame(self):
+        if self.position >= self.count:
+            if not self.loop:
+                return None
+            self.position = 0
+            self.__clock_offset = None
+
+        entry = self.index[self.position]
+        if not self.fast:
+            if self.__clock_offset is None:
+                self.__clock_offset = time.monotonic() - entry['timestamp']
+            delay = entry['timestamp'] + self.__clock_offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        self.recorded_timestamp = float(entry['timestamp'])
+        self.sequence = int(entry['sequence'])
+        no_machine = entry['tool'] < 0 and np.isnan(entry['coords']).all()
+        self.machine = None if no_machine else entry.copy()
+        self.timestamp = time.monotonic()
+
+        # A read only view straight into the page cache, nothing is copied or decoded
+        frame = np.asarray(self.frames[self.position])
+        self.position += 1
+        return frame
@@ -0,0 +1,90 @@
+from tamv_pipeline.compiler import convert
+import time
+import cv2
+
+
+class AdaptiveScheduler:
+    def __init__(self, target_latency=0.05, max_interval=8, motion_threshold=2.0, idle_after=3.0, idle_rate=2.0,
+                 smoothing=0.2, thumbnail_size=(64, 48)):
+        self.target_latency = target_latency
+        self.max_interval = max_interval
+        self.motion_threshold = motion_threshold
+        self.idle_after = idle_after
+        self.idle_rate = idle_rate
+        self.smoothing = smoothing
+        self.thumbnail_size = thumbnail_size
+
+        # Expensive stages run on every interval-th frame while there is motion
+        self.interval = 1
+        # Smoothed latency of every frame, and of the frames that ran the expensive stages
+        self.latency = None
+        self.full_latency = None
+        self.idle = False
+        self.motion = 0.0
+
+        self.full_runs = 0
+        self.skipped_runs = 0
+
+        self.__frames_since_full = 0
+        self.__reference = None
+        self.__planned = None
+        self.__settings = None
+        self.__last_motion = time.monotonic()
+
+    def thumbnail(self, frame, colorspace):
+        small = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        return convert(small, colorspace, 'GRAY') if small.ndim == 3 else small
+
+    def plan(self, frame, colorspace, settings=None, now=None):
+        now = time.monotonic() if now is None else now
+
+        # Mean absolute difference of tiny gray thumbnails, against the frame of the last full run
+        thumbnail = self.thumbnail(frame, colorspace)
+        if self.__reference is None or self.__reference.shape != thumbnail.shape:
+            self.motion = float('inf')
+        else:
+            self.motion = float(cv2.absdiff(thumbnail, self.__reference).mean())
+        moving = self.motion > self.motion_threshold
+
+        # A settings change needs fresh results just like motion does
+        if settings != self.__settings:
+            self.__settings = settings
+            moving = True
+
+        if moving:
+            self.__last_motion = now
+        self.idle = now - self.__last_motion >= self.idle_after
+
+        self.__frames_since_full += 1
+        # Kept until record() says what actually ran, the chain may run in full anyway
+        self.__planned = thumbnail
+        if moving:
+            return self.__frames_since_full >= self.interval
+        # A static scene only gets an occasional refresh, so slow drift is still caught
+        return self.__frames_since_full >= self.max_interval
+
+    def smooth(self, average, latency):
+        return latency if average is None else average + self.smoothing * (latency - average)
+
+    def record(self, latency, full=True):
+        self.latency = self.smooth(self.latency, latency)
+        if not full:
+            self.skipped_runs += 1
+            return
+
+        self.full_runs += 1
+        self.__frames_since_full = 0
+        if self.__planned is not None:
+            self.__reference = self.__planned
+
+        # Cheap skipped frames would hide a deadline every full run misses, only full runs drive the interval.
+        # Adjusted once per full run so a change has a chance to show an effect.
+        # Back off quickly when over budget, win frames back slowly once there is headroom
+        self.full_latency = self.smooth(self.full_latency, latency)
+        if self.full_latency > self.target_latency:
+            self.interval = min(self.interval * 2, self.max_interval)
+        elif self.full_latency < self.target_latency / 2 and self.interval > 1:
+            self.interval -= 1
+
+    def frame_interval(self):
+        return 1 / self.idle_rate if self.idle and self.idle_rate > 0 else 0.0
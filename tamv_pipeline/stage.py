@@ -0,0 +1,67 @@
+import collections.abc
+import threading
+
+
+class Settings(collections.abc.Mapping):
+    __slots__ = ('__values', '__version')
+
+    def __init__(self, values, version=0):
+        self.__values = dict(values)
+        self.__version = version
+
+    @property
+    def version(self):
+        return self.__version
+
+    def __getitem__(self, name):
+        return self.__values[name]
+
+    def __iter__(self):
+        return iter(self.__values)
+
+    def __len__(self):
+        return len(self.__values)
+
+    def replace(self, **changes):
+        unknown = [name for name in changes if name not in self.__values]
+        if unknown:
+            raise KeyError(f'Unknown settings: {", ".join(unknown)}')
+        if all(self.__values[name] == value for name, value in changes.items()):
+            # Unchanged values keep the version, so caches keyed on it stay warm
+            return self
+        return Settings(dict(self.__values, **changes), self.__version + 1)
+
+
+class Stage:
+    # Setting name: [default, type, low end, high end], the GUI builds its widgets from this
+    settings = {}
+
+    # Stage contract checked by the chain compiler
+    input_colorspaces = None
+    output_colorspace = None
+    dtypes = ('uint8',)
+    conversion_only = False
+
+    # Expensive stages may be skipped by the adaptive scheduler, their last result is carried forward
+    expensive = False
+
+    def __init__(self, name=None, **overrides):
+        self.name = name if name is not None else type(self).__name__
+        self.snapshot = Settings({setting: spec[0] for setting, spec in self.settings.items()}).replace(**overrides)
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def update(self, **changes):
+        # Published as one reference swap, a frame in flight keeps the snapshot it started with
+        with self.__lock:
+            self.snapshot = self.snapshot.replace(**changes)
+            return self.snapshot
+
+    def reset(self):
+        pass
+
+    def is_noop(self):
+        return False
+
+    def process(self, frame, info):
+        raise NotImplementedError
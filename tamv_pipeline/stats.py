@@ -0,0 +1,106 @@
+import collections
+import threading
+import json
+import time
+
+
+# Upper bucket edges in milliseconds, the last bucket catches everything slower
+HISTOGRAM_EDGES_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(int(fraction * len(sorted_samples)), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+
+class StageStats:
+    def __init__(self, window=300):
+        self.samples = collections.deque(maxlen=window)
+        self.timestamps = collections.deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.last_error = None
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.timestamps.append(time.monotonic())
+        self.count += 1
+
+    def record_error(self, error=None):
+        self.errors += 1
+        self.last_error = str(error) if error is not None else None
+
+    def summary(self):
+        samples = sorted(self.samples)
+        timestamps = list(self.timestamps)
+
+        histogram = [0] * (len(HISTOGRAM_EDGES_MS) + 1)
+        for sample in samples:
+            sample_ms = sample * 1000
+            bucket = 0
+            while bucket < len(HISTOGRAM_EDGES_MS) and sample_ms > HISTOGRAM_EDGES_MS[bucket]:
+                bucket += 1
+            histogram[bucket] += 1
+
+        rate = 0.0
+        if len(timestamps) > 1 and timestamps[-1] > timestamps[0]:
+            rate = (len(timestamps) - 1) / (timestamps[-1] - timestamps[0])
+
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'mean_ms': sum(samples) / len(samples) * 1000 if samples else 0.0,
+            'p50_ms': percentile(samples, 0.5) * 1000,
+            'p90_ms': percentile(samples, 0.9) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'max_ms': samples[-1] * 1000 if samples else 0.0,
+            'rate_hz': rate,
+            'histogram': histogram,
+        }
+
+
+class PipelineStats:
+    def __init__(self, window=300):
+        self.window = window
+        self.__stages = {}
+        self.__lock = threading.Lock()
+
+    def stage(self, name):
+        stage = self.__stages.get(name)
+        if stage is None:
+            with self.__lock:
+                stage = self.__stages.setdefault(name, StageStats(self.window))
+        return stage
+
+    def record(self, name, seconds):
+        self.stage(name).record(seconds)
+
+    def record_error(self, name, error=None):
+        self.stage(name).record_error(error)
+
+    def reset(self):
+        with self.__lock:
+            self.__stages = {}
+
+    def snapshot(self):
+        with self.__lock:
+            stages = list(self.__stages.items())
+        return {name: stage.summary() for name, stage in stages}
+
+    def to_json(self, indent=2):
+        return json.dumps({
+            'histogram_edges_ms': list(HISTOGRAM_EDGES_MS),
+            'stages': self.snapshot(),
+        }, indent=indent)
+
+    def format_table(self):
+        lines = [f'{"stage":<20}{"ms":>7}{"p90":>7}{"Hz":>6}{"err":>5}']
+        for name, summary in self.snapshot().items():
+            lines.append(
+                f'{name[:19]:<20}{summary["mean_ms"]:7.1f}{summary["p90_ms"]:7.1f}'
+                f'{summary["rate_hz"]:6.1f}{summary["errors"]:5d}'
+            )
+        return '\n'.join(lines)
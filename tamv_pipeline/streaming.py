@@ -0,0 +1,276 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from tamv_pipeline.pipeline import keypoints_to_list
+from tamv_pipeline.compiler import convert
+from tamv_pipeline.overlay import Overlay
+import threading
+import json
+import time
+import html
+import cv2
+
+
+BOUNDARY = b'tamvframe'
+
+
+class EncodedFrame:
+    __slots__ = ('index', 'sequence', 'revision', 'timestamp', 'jpeg')
+
+    def __init__(self, index, sequence, revision, timestamp, jpeg):
+        self.index = index
+        self.sequence = sequence
+        self.revision = revision
+        self.timestamp = timestamp
+        self.jpeg = jpeg
+
+
+class FrameBroadcaster(threading.Thread):
+    def __init__(self, source, quality=80, max_fps=15, draw_keypoints=True, poll_interval=0.5):
+        self.source = source
+        self.quality = quality
+        self.frame_interval = 1 / max_fps if max_fps else 0
+        self.draw_keypoints = draw_keypoints
+        self.poll_interval = poll_interval
+
+        self.latest = None
+        self.clients = 0
+        self.encoded = 0
+        self.overlay = Overlay()
+
+        self.__condition = threading.Condition()
+        self.__stop = threading.Event()
+
+        threading.Thread.__init__(self, daemon=True)
+
+    def add_client(self):
+        with self.__condition:
+            self.clients += 1
+            self.__condition.notify_all()
+
+    def remove_client(self):
+        with self.__condition:
+            self.clients -= 1
+
+    def stopped(self):
+        return self.__stop.is_set()
+
+    def encode(self, result):
+        frame = result.frame
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        elif result.colorspace == 'RGB':
+            frame = convert(frame, 'RGB', 'BGR')
+        else:
+            # Never draw on the pipeline's result
+            frame = frame.copy()
+
+        if self.draw_keypoints:
+            frame = self.overlay.draw(frame, result.keypoints, radii=result.radii)
+        success, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return jpeg.tobytes() if success else None
+
+    def run(self):
+        shown = None
+        next_frame = time.monotonic()
+        while not self.__stop.is_set():
+            # Nothing is encoded while nobody is watching
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.clients > 0 or self.__stop.is_set())
+            if self.__stop.is_set():
+                break
+
+            sequence = shown[0] if shown is not None else 0
+            result = self.source.wait_for_result(sequence, timeout=self.poll_interval)
+            if result is None:
+                # Freeze-frame tuning republishes the same sequence with a new revision
+                result = self.source.result
+            if result is None or (result.sequence, result.revision) == shown:
+                continue
+            shown = (result.sequence, result.revision)
+
+            jpeg = self.encode(result)
+            if jpeg is None:
+                continue
+
+            # Encoded once, every client picks up the same bytes
+            with self.__condition:
+                self.encoded += 1
+                self.latest = EncodedFrame(self.encoded, result.sequence, result.revision, result.timestamp, jpeg)
+                self.__condition.notify_all()
+
+            if self.frame_interval:
+                next_frame = max(next_frame + self.frame_interval, time.monotonic())
+                self.__stop.wait(next_frame - time.monotonic())
+
+    def next_frame(self, after_index=0, timeout=None):
+        # Clients only ever get the newest frame, one that cannot keep up skips frames instead of queueing them
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: self.__stop.is_set() or (self.latest is not None and self.latest.index > after_index),
+                timeout
+            )
+            if self.latest is not None and self.latest.index > after_index:
+                return self.latest
+            return None
+
+    def close(self):
+        self.__stop.set()
+        with self.__condition:
+            self.__condition.notify_all()
+
+
+class StreamRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, code, body, content_type='application/json'):
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        # Camera names are quoted into a single path segment, file paths included
+        parts = [unquote(part) for part in url.path.split('/') if part]
+
+        if not parts:
+            self.send_index()
+            return
+
+        # With a single camera the name may be left out of the path
+        if len(parts) == 1:
+            name, resource = next(iter(self.server.broadcasters)), parts[0]
+        elif len(parts) == 2:
+            name, resource = parts
+        else:
+            name, resource = None, None
+
+        broadcaster = self.server.broadcasters.get(name)
+        if broadcaster is None:
+            self.send(404, {'err': 'not found'})
+        elif resource == 'stream.mjpg':
+            self.send_stream(broadcaster)
+        elif resource == 'snapshot.jpg':
+            self.send_snapshot(broadcaster)
+        elif resource == 'keypoints.json':
+            self.send_keypoints(name, broadcaster.source, query)
+        elif resource == 'stats.json' and hasattr(broadcaster.source, 'stats'):
+            self.send(200, broadcaster.source.stats.snapshot())
+        else:
+            self.send(404, {'err': 'not found'})
+
+    def send_index(self):
+        cameras = ''
+        for name in self.server.broadcasters:
+            path = quote(name, safe='')
+            cameras += f'<figure><img src="/{path}/stream.mjpg"><figcaption>{html.escape(name)}</figcaption></figure>'
+        self.send(200, f'<!DOCTYPE html><html><head><title>TAMV</title></head><body>{cameras}</body></html>', 'text/html')
+
+    def send_stream(self, broadcaster):
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY.decode()}')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        broadcaster.add_client()
+        try:
+            index = 0
+            while not broadcaster.stopped():
+                frame = broadcaster.next_frame(index, timeout=5)
+                if frame is None:
+                    continue
+                index = frame.index
+                self.wfile.write(
+                    b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                    + str(len(frame.jpeg)).encode() + b'\r\n\r\n' + frame.jpeg + b'\r\n'
+                )
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            broadcaster.remove_client()
+
+    def send_snapshot(self, broadcaster):
+        broadcaster.add_client()
+        try:
+            # Wait for a fresh encode, the last one may be old if nobody was watching
+            previous = broadcaster.latest.index if broadcaster.latest is not None else 0
+            frame = broadcaster.next_frame(previous, timeout=2) or broadcaster.latest
+        finally:
+            broadcaster.remove_client()
+
+        if frame is None:
+            self.send(503, {'err': 'no frame yet'})
+        else:
+            self.send(200, frame.jpeg, 'image/jpeg')
+
+    def send_keypoints(self, name, source, query):
+        # ?after=<sequence> long-polls for the next result instead of returning the current one
+        if 'after' in query:
+            try:
+                after, timeout = int(query['after']), float(query.get('timeout', 5))
+            except ValueError:
+                timeout = None
+            # Also keeps a nan or endless timeout from parking the handler thread
+            if timeout is None or not 0 <= timeout <= 60:
+                self.send(400, {'err': 'after must be an integer and timeout between 0 and 60 seconds'})
+                return
+            result = source.wait_for_result(after, timeout=timeout)
+            if result is None:
+                # Nothing new before the timeout, a 204 carries no body
+                self.send_response(204)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                return
+        else:
+            result = source.result
+        if result is None:
+            self.send(503, {'err': 'no result yet'})
+            return
+
+        self.send(200, {
+            'camera': name,
+            'sequence': result.sequence,
+            'revision': result.revision,
+            'age': time.monotonic() - result.timestamp,
+            'keypoints_age': time.monotonic() - result.keypoints_timestamp,
+            'latency': result.latency,
+            'keypoints': keypoints_to_list(result.keypoints),
+            'search': result.search,
+            'consensus': result.consensus,
+        })
+
+
+class StreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, sources, quality=80, max_fps=15):
+        ThreadingHTTPServer.__init__(self, address, StreamRequestHandler)
+        self.broadcasters = {name: FrameBroadcaster(source, quality, max_fps) for name, source in sources.items()}
+
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def close(self):
+        for broadcaster in self.broadcasters.values():
+            broadcaster.close()
+        self.shutdown()
+        self.server_close()
+
+
+def start_stream_server(sources, host='0.0.0.0', port=8081, quality=80, max_fps=15):
+    server = StreamServer((host, port), sources, quality, max_fps)
+    for broadcaster in server.broadcasters.values():
+        broadcaster.start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
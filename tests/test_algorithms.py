@@ -0,0 +1,114 @@
+import pytest
+
+pytest.importorskip('cv2')
+
+from benchmarks.synthetic import generate_frame, generate_frames
+from tamv_algorithms.consensus import Consensus, estimate
+from tamv_pipeline.pipeline import AlgorithmChain
+from tamv_pipeline.compiler import FrameInfo
+import numpy as np
+
+
+def centre_error(keypoints, frame):
+    return np.hypot(keypoints[0][0] - frame.centre[0], keypoints[0][1] - frame.centre[1])
+
+
+def test_estimate_rejects_outliers():
+    rng = np.random.default_rng(0)
+    samples = np.vstack([rng.normal((120.0, 80.0), 0.1, (12, 2)), [[160.0, 80.0], [120.0, 30.0]]])
+    centre, inliers, spread = estimate(samples, 3, 0.5)
+
+    assert inliers.tolist() == [True] * 12 + [False, False]
+    assert centre == pytest.approx((120.0, 80.0), abs=0.1)
+    assert spread < 0.5
+
+
+def test_estimate_keeps_everything_within_tolerance():
+    samples = np.array([[10.0, 10.0], [10.0, 10.0], [10.0, 10.0], [10.3, 10.0]])
+    centre, inliers, spread = estimate(samples, 3, 0.5)
+
+    # The MAD is zero here, the tolerance keeps the threshold from rejecting a 0.3 px sample
+    assert inliers.all()
+    assert spread == pytest.approx(0.225)
+
+
+def test_consensus_converges_on_fresh_detections_only():
+    stage = Consensus(min_samples=3, tolerance_tenths_px=5)
+    info = FrameInfo('GRAY')
+
+    for i, point in enumerate([(50.0, 40.0), (50.2, 40.1), (49.9, 39.9), (50.1, 40.0)]):
+        _, result = stage.process(None, info.replace(keypoints=[point]))
+        assert result.consensus['converged'] == (i >= 2)
+        assert result.consensus['fresh']
+    assert result.keypoints[0] == pytest.approx((50.05, 40.0))
+    assert result.raw_keypoints == [(50.1, 40.0)]
+
+    # A frame without a detection repeats the estimate but is never a converged fix
+    _, result = stage.process(None, info.replace(keypoints=[]))
+    assert result.keypoints[0] == pytest.approx((50.05, 40.0))
+    assert not result.consensus['fresh']
+    assert not result.consensus['converged']
+
+    stage.reset()
+    _, result = stage.process(None, info.replace(keypoints=[]))
+    assert result.keypoints == [] and result.consensus['centre'] is None
+
+
+def test_consensus_follows_closest_detection():
+    stage = Consensus()
+    info = FrameInfo('GRAY')
+    stage.process(None, info.replace(keypoints=[(50.0, 40.0)]))
+    _, result = stage.process(None, info.replace(keypoints=[(200.0, 10.0), (50.4, 40.0)], radii=[30, 12]))
+
+    assert result.keypoints[0] == pytest.approx((50.2, 40.0))
+    assert result.radii == [12]
+
+
+def test_hough_roi_tracks_and_reacquires():
+    rng = np.random.default_rng(0)
+    chain = AlgorithmChain(['grayscale', 'hough_circle_finder'], 'BGR')
+    chain.stages['hough_circle_finder'].update(tracking=True)
+
+    searches = []
+    for centre in [(160, 120), (164, 122), (168, 120), (80, 70), (84, 72), (220, 150)]:
+        frame = generate_frame(320, 240, rng, noise=1.0, radius=0.2, centre=centre)
+        _, info = chain.process(frame.image)
+        assert centre_error(info.keypoints, frame) <= 2
+        searches.append(info.search)
+    # Small moves stay inside the region of interest, a jump out of it falls back to a full-frame search
+    assert searches == ['full', 'roi', 'roi', 'full', 'roi', 'full']
+
+    # Losing the nozzle drops the tracking state, the next frame searches everywhere again
+    _, info = chain.process(np.full((240, 320, 3), 110, dtype=np.uint8))
+    assert info.keypoints == [] and chain.stages['hough_circle_finder'].last_detection is None
+    frame = generate_frame(320, 240, rng, noise=1.0, radius=0.2, centre=(160, 120))
+    _, info = chain.process(frame.image)
+    assert info.search == 'full' and centre_error(info.keypoints, frame) <= 2
+
+
+def test_hough_roi_forces_periodic_full_search():
+    rng = np.random.default_rng(0)
+    chain = AlgorithmChain(['grayscale', 'hough_circle_finder'], 'BGR')
+    chain.stages['hough_circle_finder'].update(tracking=True, full_search_interval=2)
+
+    searches = []
+    for _ in range(5):
+        frame = generate_frame(320, 240, rng, noise=1.0, radius=0.2, centre=(160, 120))
+        searches.append(chain.process(frame.image)[1].search)
+    assert searches == ['full', 'roi', 'roi', 'full', 'roi']
+
+
+def test_template_locator_tracks_moving_nozzle():
+    frames = generate_frames(320, 240, 20, seed=0, motion=6.0, radius=0.15)
+    chain = AlgorithmChain(['grayscale', 'template_locator'], 'BGR')
+    locator = chain.stages['template_locator']
+    first = frames[0]
+    # Lined up once, the way a user centres the nozzle before tuning
+    locator.capture_template(chain.process(first.image)[0], first.centre, int(first.radius * 2.5))
+
+    searches = []
+    for frame in frames:
+        _, info = chain.process(frame.image)
+        assert centre_error(info.keypoints, frame) <= 1
+        searches.append(info.search)
+    assert searches[0] == 'template' and set(searches[1:]) == {'template_roi'}
@@ -0,0 +1,76 @@
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('requests')
+
+from duetwebapi.simulator import SimulatedPrinter, start_simulator
+from tamv_pipeline.calibration import CalibrationEngine
+from tamv_pipeline.pipeline import AlgorithmThread
+from benchmarks.synthetic import generate_frame
+from duetwebapi.duetwebapi import DuetWebAPI
+import numpy as np
+import time
+
+
+CAMERA = (100.3, 99.8)
+# Millimetres from the carriage to each nozzle, what the calibration has to find
+NOZZLES = {0: (0.0, 0.0), 1: (0.6, -0.4), 2: (-0.3, 0.5)}
+# Image pixels per millimetre of machine movement, the camera is slightly rotated
+PIXELS_PER_MM = np.array([[30.0, 2.0], [-1.5, 30.0]])
+
+
+class SimulatedCamera:
+    colorspace = 'BGR'
+
+    def __init__(self, printer, width=320, height=240, interval=0.01):
+        self.printer = printer
+        self.width = width
+        self.height = height
+        self.interval = interval
+        self.rng = np.random.default_rng(0)
+
+    def get_frame(self):
+        time.sleep(self.interval)
+        tool = self.printer.current_tool
+        if tool < 0:
+            return np.full((self.height, self.width, 3), 110, dtype=np.uint8)
+        x, y = self.printer.position()[:2]
+        nozzle = np.array([x + NOZZLES[tool][0] - CAMERA[0], y + NOZZLES[tool][1] - CAMERA[1]])
+        centre = np.array([self.width / 2, self.height / 2]) + PIXELS_PER_MM @ nozzle
+        return generate_frame(self.width, self.height, self.rng, noise=1.0, radius=0.15, centre=centre).image
+
+
+@pytest.fixture
+def machine():
+    printer = SimulatedPrinter(3, tools=3, speed=200.0, tool_change_time=0.05, gcode_delay=0.01)
+    server = start_simulator(printer)
+    api = DuetWebAPI(server.url())
+    vision = AlgorithmThread(SimulatedCamera(printer))
+    assert vision.load_algorithms(['grayscale', 'hough_circle_finder'])
+    vision.start()
+    yield api, vision, printer
+    vision.close()
+    api.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_calibration_finds_tool_offsets(machine):
+    api, vision, printer = machine
+    engine = CalibrationEngine(
+        api, vision, {'X': 100.0, 'Y': 100.0}, tolerance_px=1.0, settle_time=0.05, sample_timeout=1.0,
+        write_offsets=True, poll_interval=0.01
+    )
+    results = engine.run()
+
+    assert [calibration.tool for calibration in results] == [0, 1, 2]
+    assert all(calibration.converged for calibration in results)
+    # Pixels per millimetre are measured from the calibration jogs, they match the camera up to detection noise
+    np.testing.assert_allclose(engine.pixels_per_mm, PIXELS_PER_MM, atol=3)
+
+    for calibration in results:
+        expected = np.subtract(NOZZLES[calibration.tool], NOZZLES[0])
+        assert [calibration.offsets['X'], calibration.offsets['Y']] == pytest.approx(expected, abs=0.1)
+        # The measured offsets were written to the machine and the last tool parked
+        assert printer.offsets[calibration.tool][:2] == pytest.approx([calibration.offsets['X'], calibration.offsets['Y']])
+    assert printer.current_tool == -1
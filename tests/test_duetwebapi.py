@@ -0,0 +1,66 @@
+from urllib.parse import quote
+import pytest
+
+pytest.importorskip('requests')
+
+from duetwebapi.duetwebapi import DuetWebAPI, batch_g_codes
+from duetwebapi.simulator import SimulatedPrinter, start_simulator
+
+
+def test_batch_g_codes_unlimited():
+    assert batch_g_codes(['G90', 'G1 X10', 'M400']) == ['G90\nG1 X10\nM400']
+    assert batch_g_codes([]) == []
+
+
+def test_batch_g_codes_respects_encoded_length():
+    commands = [f'G1 X{i} Y{i} F6000' for i in range(40)]
+    blocks = batch_g_codes(commands, 60)
+
+    assert '\n'.join(blocks).split('\n') == commands
+    assert all(len(quote(block, safe='')) <= 60 for block in blocks)
+
+
+def test_batch_g_codes_oversized_command_gets_own_block():
+    blocks = batch_g_codes(['G90', 'M117 ' + 'x' * 100, 'G91'], 40)
+    assert blocks == ['G90', 'M117 ' + 'x' * 100, 'G91']
+
+
+@pytest.fixture(params=[2, 3])
+def api(request):
+    # Slow enough that a move is still running when a premature wait would return
+    printer = SimulatedPrinter(request.param, tools=2, speed=50.0, tool_change_time=0.2, gcode_delay=0.1)
+    server = start_simulator(printer)
+    api = DuetWebAPI(server.url())
+    yield api, printer
+    api.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_send_g_codes_wait_returns_after_move(api):
+    api, printer = api
+    api.send_g_codes(['G90', 'G1 X20 Y10 F6000'], wait=True, timeout=10)
+
+    assert not printer.busy()
+    coords = api.get_coords()
+    assert coords['X'] == pytest.approx(20)
+    assert coords['Y'] == pytest.approx(10)
+
+
+def test_send_g_codes_wait_for_position(api):
+    api, printer = api
+    api.send_g_codes(['G90', 'G1 X5 Y15 F6000'], wait=True, timeout=10, position={'X': 5, 'Y': 15})
+    assert printer.position()[:2] == pytest.approx([5, 15])
+
+
+def test_wait_until_idle_times_out(api):
+    api, printer = api
+    api.send_g_codes(['G90', 'G1 X200 F6000'])
+    with pytest.raises(TimeoutError):
+        api.wait_until_idle(timeout=0.2, start_timeout=0.15)
+
+
+def test_wait_until_idle_without_motion(api):
+    api, printer = api
+    coords = api.wait_until_idle(timeout=1)
+    assert coords['X'] == pytest.approx(0)
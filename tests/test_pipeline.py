@@ -0,0 +1,247 @@
+import pytest
+
+pytest.importorskip('cv2')
+
+from benchmarks.synthetic import generate_frames
+from tamv_pipeline.pipeline import AlgorithmChain, AlgorithmThread, FrameQueue
+from tamv_pipeline.compiler import compile_chain
+from tamv_pipeline.scheduler import AdaptiveScheduler
+from tamv_pipeline.stage import Settings, Stage
+import numpy as np
+import time
+
+
+class CountingStage(Stage):
+    settings = {
+        'gain': [1, 'slider', 1, 10],
+    }
+
+    def reset(self):
+        self.calls = 0
+
+    def process(self, frame, info):
+        self.calls += 1
+        return frame, info
+
+
+class FrameStream:
+    colorspace = 'BGR'
+
+    def __init__(self, frames, interval=0.005):
+        self.frames = frames
+        self.interval = interval
+        self.position = 0
+
+    def get_frame(self):
+        time.sleep(self.interval)
+        frame = self.frames[self.position % len(self.frames)].image
+        self.position += 1
+        return frame
+
+
+@pytest.fixture(scope='module')
+def frames():
+    return generate_frames(320, 240, 4, radius=0.2, noise=1.0)
+
+
+def test_settings_replace_bumps_version_only_on_change():
+    settings = Settings({'a': 1, 'b': True})
+    assert settings.version == 0
+
+    assert settings.replace(a=1) is settings
+    changed = settings.replace(a=2)
+    assert changed.version == 1 and changed['a'] == 2
+    assert settings['a'] == 1
+    assert changed.replace(b=False).version == 2
+
+    with pytest.raises(KeyError):
+        settings.replace(c=3)
+
+
+def test_stage_update_publishes_new_snapshot():
+    stage = CountingStage(gain=3)
+    before = stage.snapshot
+    assert before['gain'] == 3
+
+    assert stage.update(gain=3) is before
+    assert stage.update(gain=4).version == before.version + 1
+    assert before['gain'] == 3
+
+
+def test_compile_chain_fuses_conversions():
+    chain = AlgorithmChain(['grayscale', 'hough_circle_finder'], 'BGR')
+    assert [(step.name, step.source, step.colorspace) for step in chain.steps] == [('hough_circle_finder', 'BGR', 'GRAY')]
+    assert chain.colorspace == 'GRAY'
+
+    # A trailing conversion is still applied, once
+    chain = AlgorithmChain(['grayscale'], 'BGR')
+    assert [(step.name, step.algorithm, step.source, step.colorspace) for step in chain.steps] == [('grayscale', None, 'BGR', 'GRAY')]
+
+
+def test_compile_chain_elides_noops():
+    names = ['gaussian_blur', 'grayscale', 'hough_circle_finder']
+    chain = AlgorithmChain(names, 'BGR')
+    assert [step.name for step in chain.steps] == ['hough_circle_finder']
+
+    steps, _ = compile_chain(names, chain.algorithms, 'BGR', elide_noops=False)
+    assert [step.name for step in steps] == ['gaussian_blur', 'hough_circle_finder']
+
+    # Turning the blur on adds its step back in front of the fused conversion
+    chain.stages['gaussian_blur'].update(blur_x=5)
+    chain.recompile()
+    assert [(step.name, step.source, step.colorspace) for step in chain.steps] == [
+        ('gaussian_blur', 'BGR', 'BGR'), ('hough_circle_finder', 'BGR', 'GRAY')
+    ]
+
+
+def test_compile_chain_rejects_invalid_order():
+    with pytest.raises(ValueError, match='hough_circle_finder'):
+        AlgorithmChain(['hough_circle_finder'], 'BGR')
+
+    grayscale = AlgorithmChain(['grayscale'], 'BGR').algorithms[0]
+    with pytest.raises(ValueError, match='float32'):
+        compile_chain(['grayscale'], [grayscale], 'BGR', dtype='float32')
+
+
+def test_chain_runs_on_synthetic_frames(frames):
+    chain = AlgorithmChain(['grayscale', 'hough_circle_finder'], 'BGR')
+    frame, info = chain.process(frames[0].image)
+
+    assert frame.ndim == 2 and info.colorspace == 'GRAY'
+    assert len(info.keypoints) >= 1
+    x, y = info.keypoints[0]
+    assert np.hypot(x - frames[0].centre[0], y - frames[0].centre[1]) < frames[0].radius / 2
+
+
+def test_process_cached_reruns_only_changed_steps(frames):
+    stages = {'first': CountingStage('first'), 'second': CountingStage('second')}
+    chain = AlgorithmChain(['first', 'second'], 'BGR', stages)
+    image = frames[0].image
+
+    assert chain.process_cached(image, 1)[2] == 2
+    assert chain.process_cached(image, 1)[2] == 0
+
+    # Only the changed stage and everything after it runs again
+    stages['second'].update(gain=2)
+    assert chain.process_cached(image, 1)[2] == 1
+    assert (stages['first'].calls, stages['second'].calls) == (1, 2)
+
+    stages['first'].update(gain=2)
+    assert chain.process_cached(image, 1)[2] == 2
+
+    # A different frame invalidates every step
+    assert chain.process_cached(frames[1].image, 2)[2] == 2
+    assert (stages['first'].calls, stages['second'].calls) == (3, 4)
+
+
+def test_process_cached_returns_cached_output(frames):
+    chain = AlgorithmChain(['grayscale', 'hough_circle_finder'], 'BGR')
+    frame, info, _ = chain.process_cached(frames[0].image, 1)
+    cached_frame, cached_info, recomputed = chain.process_cached(frames[0].image, 1)
+
+    assert recomputed == 0
+    assert cached_frame is frame and cached_info is info
+
+
+def test_freeze_reprocesses_held_frame_on_settings_change(frames):
+    vision = AlgorithmThread(FrameStream(frames))
+    assert vision.load_algorithms(['gaussian_blur', 'grayscale', 'hough_circle_finder'])
+    vision.freeze()
+    vision.start()
+    try:
+        deadline = time.monotonic() + 5
+        while vision.result is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        first = vision.result
+        assert first is not None and first.revision == 1
+
+        # Unchanged settings leave the held frame alone
+        time.sleep(0.1)
+        assert vision.result is first
+
+        vision.stages['gaussian_blur'].update(blur_x=5)
+        while vision.result is first and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert vision.result.revision == 2
+        assert vision.result.sequence == first.sequence
+    finally:
+        vision.close()
+        vision.join(1)
+
+
+def test_frame_queue_drops_oldest():
+    queue = FrameQueue(2)
+    assert [queue.put(np.full(1, i)) for i in range(5)] == [1, 2, 3, 4, 5]
+    assert queue.dropped == 3
+    assert queue.pending() == 2
+
+    assert [queue.get(timeout=0).sequence for _ in range(2)] == [4, 5]
+    assert queue.get(timeout=0) is None
+
+    queue.close()
+    assert queue.closed()
+    assert queue.get() is None
+
+
+def test_scheduler_backs_off_when_over_budget(frames):
+    scheduler = AdaptiveScheduler(target_latency=0.01, max_interval=4)
+    image = frames[0].image
+
+    assert scheduler.plan(image, 'BGR', now=0)
+    scheduler.record(0.05)
+    assert scheduler.interval == 2
+    scheduler.plan(image, 'BGR', now=0.1)
+    scheduler.record(0.05)
+    assert scheduler.interval == 4
+    scheduler.plan(image, 'BGR', now=0.2)
+    scheduler.record(0.05)
+    assert scheduler.interval == 4
+
+    # Skipped frames do not count against the budget
+    scheduler.record(0.0001, full=False)
+    assert scheduler.interval == 4 and scheduler.skipped_runs == 1
+
+    for _ in range(20):
+        scheduler.record(0.001)
+    assert scheduler.interval == 1
+
+
+def test_scheduler_skips_moving_frames_between_intervals(frames):
+    scheduler = AdaptiveScheduler(target_latency=0.01, max_interval=8, motion_threshold=2.0)
+    scheduler.interval = 3
+
+    plans = []
+    for i, frame in enumerate(frames * 2):
+        full = scheduler.plan(frame.image, 'BGR', now=i * 0.01)
+        plans.append(full)
+        scheduler.record(0.001 if full else 0.0001, full)
+        scheduler.interval = 3
+    assert plans == [False, False, True, False, False, True, False, False]
+
+
+def test_scheduler_goes_idle_on_static_scene(frames):
+    scheduler = AdaptiveScheduler(max_interval=4, idle_after=1.0, idle_rate=5.0)
+    image = frames[0].image
+
+    plans = []
+    for i in range(9):
+        full = scheduler.plan(image, 'BGR', now=i * 0.2)
+        plans.append(full)
+        scheduler.record(0.001, full)
+    # Only the first frame and the occasional refresh run the expensive stages
+    assert plans == [True, False, False, False, True, False, False, False, True]
+    assert scheduler.idle
+    assert scheduler.frame_interval() == pytest.approx(0.2)
+
+    # Motion wakes it straight away
+    assert scheduler.plan(frames[1].image, 'BGR', now=2.0)
+    assert not scheduler.idle
+    assert scheduler.frame_interval() == 0.0
+
+    # So does a settings change on a static scene
+    scheduler.record(0.001)
+    for i in range(8):
+        scheduler.plan(frames[1].image, 'BGR', now=2.2 + i * 0.2)
+    assert scheduler.idle
+    assert scheduler.plan(frames[1].image, 'BGR', settings=(1,), now=4.0)
+    assert not scheduler.idle
@@ -0,0 +1,75 @@
+import pytest
+
+pytest.importorskip('cv2')
+
+from tamv_pipeline.recording import FrameRecorder, RecordingCapture, read_header
+from benchmarks.synthetic import generate_frames
+import numpy as np
+
+
+@pytest.fixture
+def frames():
+    return generate_frames(64, 48, 5, radius=0.2)
+
+
+def test_round_trip(tmp_path, frames):
+    path = str(tmp_path / 'capture.tamvrec')
+    machines = [
+        {'coords': [1.0, 2.0, 3.0], 'tool': 0},
+        # Telemetry that only reports X and Y
+        {'coords': [4.0, 5.0], 'tool': 1},
+        None,
+        {'coords': [6.0, 7.0, 8.0], 'tool': 1},
+        {'coords': [9.0, 10.0, 11.0], 'tool': 2},
+    ]
+    with FrameRecorder(path, axes='XYZ') as recorder:
+        for i, (frame, machine) in enumerate(zip(frames, machines)):
+            assert recorder.write(frame.image, i + 1, 100.0 + i / 30, machine)
+
+    count, layout = read_header(path)
+    assert count == 5
+    assert layout.shape == (48, 64, 3) and layout.colorspace == 'BGR' and layout.axes == 'XYZ'
+
+    replay = RecordingCapture(path, fast=True)
+    assert (replay.width, replay.height, replay.colorspace) == (64, 48, 'BGR')
+    assert replay.fps == pytest.approx(30)
+
+    for i, (frame, machine) in enumerate(zip(frames, machines)):
+        np.testing.assert_array_equal(replay.get_frame(), frame.image)
+        assert replay.sequence == i + 1
+        assert replay.recorded_timestamp == pytest.approx(100.0 + i / 30)
+        if machine is None:
+            assert replay.machine is None
+            continue
+        assert replay.machine['tool'] == machine['tool']
+        expected = machine['coords'] + [np.nan] * (3 - len(machine['coords']))
+        np.testing.assert_array_equal(replay.machine['coords'], expected)
+    assert replay.get_frame() is None
+
+
+def test_replay_loops(tmp_path, frames):
+    path = str(tmp_path / 'capture.tamvrec')
+    with FrameRecorder(path) as recorder:
+        for i, frame in enumerate(frames[:2]):
+            recorder.write(frame.image, i + 1, float(i))
+
+    replay = RecordingCapture(path, fast=True, loop=True)
+    assert [replay.get_frame() is not None and replay.sequence for _ in range(5)] == [1, 2, 1, 2, 1]
+
+
+def test_capacity_and_shape_checks(tmp_path, frames):
+    path = str(tmp_path / 'capture.tamvrec')
+    with FrameRecorder(path, capacity=2) as recorder:
+        assert recorder.write(frames[0].image, 1, 0.0)
+        with pytest.raises(ValueError):
+            recorder.write(frames[1].image[:10], 2, 1.0)
+        assert [recorder.write(frame.image, i + 2, float(i + 1)) for i, frame in enumerate(frames[1:3])] == [True, False]
+        assert recorder.skipped == 1
+    assert read_header(path)[0] == 2
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / 'capture.tamvrec'
+    path.write_bytes(b'not a recording')
+    with pytest.raises(ValueError):
+        RecordingCapture(str(path))